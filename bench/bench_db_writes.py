@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import database
+
+create_table = '''CREATE TABLE IF NOT EXISTS ProcessedFile
+                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  local_file TEXT,
+                  source_file TEXT,
+                  status TEXT,
+                  image_created_datetime TEXT,
+                  updated_datetime TEXT)'''
+
+insert_row = '''INSERT INTO ProcessedFile
+                (local_file, source_file, status, image_created_datetime, updated_datetime)
+                VALUES (?, ?, ?, ?, ?)'''
+
+
+def make_rows(pages):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [(f"bench_{i + 1}.jpg", "bench.pdf", 'Processing', now, now) for i in range(pages)]
+
+
+def run_per_row_commit(db_path, rows):
+    # The original write path: default rollback journal, one INSERT and one commit per page
+    conn = sqlite3.connect(db_path)
+    conn.execute(create_table)
+    conn.commit()
+    start_time = time.perf_counter()
+    for row in rows:
+        conn.execute(insert_row, row)
+        conn.commit()
+    elapsed = time.perf_counter() - start_time
+    conn.close()
+    return elapsed, len(rows)
+
+
+def run_batched(db_path, rows, batch_size):
+    # The batched write path: WAL connection, executemany with one commit per batch
+    conn = database.connect(db_path)
+    conn.execute(create_table)
+    conn.commit()
+    start_time = time.perf_counter()
+    commits = 0
+    for start in range(0, len(rows), batch_size):
+        conn.executemany(insert_row, rows[start:start + batch_size])
+        conn.commit()
+        commits += 1
+    elapsed = time.perf_counter() - start_time
+    conn.close()
+    return elapsed, commits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-page commits with batched WAL writes for ProcessedFile.")
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dir", default=None, help="Directory for the scratch databases (use the production mount to measure its fsync cost).")
+    args = parser.parse_args()
+
+    rows = make_rows(args.pages)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        before, before_commits = run_per_row_commit(os.path.join(tmp, 'before.db'), rows)
+        after, after_commits = run_batched(os.path.join(tmp, 'after.db'), rows, args.batch_size)
+
+    print(f"{'mode':<24}{'seconds':>10}{'commits':>10}{'commits/sec':>14}{'rows/sec':>14}")
+    print(f"{'per-row commit':<24}{before:>10.3f}{before_commits:>10}{before_commits / before:>14.1f}{len(rows) / before:>14.1f}")
+    print(f"{'batched WAL':<24}{after:>10.3f}{after_commits:>10}{after_commits / after:>14.1f}{len(rows) / after:>14.1f}")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
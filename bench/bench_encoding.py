@@ -0,0 +1,95 @@
+import io
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import render_profiles
+
+# (label, PIL format, save options); AVIF is skipped when Pillow was built without it
+variants = [
+    ('jpeg q75 (PIL default)', 'JPEG', {'quality': 75}),
+    ('jpeg q85 optimize', 'JPEG', {'quality': 85, 'optimize': True}),
+    ('jpeg q70 progressive', 'JPEG', {'quality': 70, 'optimize': True, 'progressive': True}),
+    ('png', 'PNG', {}),
+    ('webp q80', 'WEBP', {'quality': 80}),
+    ('webp q60', 'WEBP', {'quality': 60}),
+    ('avif q60', 'AVIF', {'quality': 60}),
+]
+
+
+def render_corpus(corpus_folder, dpi, max_pages):
+    # Decode up to max_pages pages from the PDFs in corpus_folder once, so only encoding is timed
+    images = []
+    for file in sorted(os.listdir(corpus_folder)):
+        if not file.endswith(".pdf") or len(images) >= max_pages:
+            continue
+        images += convert_from_path(os.path.join(corpus_folder, file), dpi=dpi, fmt='ppm',
+                                    last_page=max_pages - len(images))
+    return images
+
+
+def encode(image, pil_format, options):
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.tell()
+
+
+def run_variant(images, pil_format, options, threads):
+    # Encode every page to memory with the given thread count; returns (seconds, total bytes)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        sizes = list(executor.map(lambda image: encode(image, pil_format, options), images))
+    return time.perf_counter() - start_time, sum(sizes)
+
+
+def run_thumbnails(images, width, threads):
+    # The same downscale and encode the thumbnail_width profile setting uses
+    quality = render_profiles.base_settings['thumbnail_quality']
+
+    def encode_thumbnail(image):
+        height = max(1, round(image.height * width / image.width))
+        thumbnail = image.resize((width, height), reducing_gap=3.0)
+        return encode(thumbnail, 'JPEG', {'quality': quality, 'optimize': True})
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        sizes = list(executor.map(encode_thumbnail, images))
+    return time.perf_counter() - start_time, sum(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare page encoding formats, quality settings and encoder threads.")
+    parser.add_argument("corpus", help="Folder of sample PDFs (see make_corpus.py).")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--pages", type=int, default=20, help="Pages decoded from the corpus.")
+    parser.add_argument("--threads", type=int, nargs='+', default=[1, 4], help="Encoder thread counts to compare.")
+    parser.add_argument("--thumbnail-width", type=int, default=320)
+    args = parser.parse_args()
+
+    images = render_corpus(args.corpus, args.dpi, args.pages)
+    if not images:
+        print(f"No PDF pages found in {args.corpus}")
+        return
+
+    print(f"{len(images)} pages at {args.dpi} DPI")
+    print(f"{'variant':<26}{'threads':>8}{'seconds':>10}{'pages/sec':>11}{'KB/page':>10}")
+    for label, pil_format, options in variants:
+        for threads in args.threads:
+            try:
+                elapsed, total_bytes = run_variant(images, pil_format, options, threads)
+            except (KeyError, OSError) as e:
+                print(f"{label:<26}{'skipped':>8}  ({e})")
+                break
+            print(f"{label:<26}{threads:>8}{elapsed:>10.3f}{len(images) / elapsed:>11.1f}{total_bytes / len(images) / 1024:>10.1f}")
+    for threads in args.threads:
+        elapsed, total_bytes = run_thumbnails(images, args.thumbnail_width, threads)
+        label = f"thumbnail {args.thumbnail_width}px"
+        print(f"{label:<26}{threads:>8}{elapsed:>10.3f}{len(images) / elapsed:>11.1f}{total_bytes / len(images) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
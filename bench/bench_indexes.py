@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import database
+
+statuses = ['pending', 'processing', 'Completed', 'Done', 'Failed', 'Deleted']
+
+
+def build_database(db_path, rows, days):
+    # Synthetic conversion.db at schema version 1: both tables, no indexes
+    conn = database.connect(db_path)
+    for statement in database.migrations[0]:
+        conn.execute(statement)
+    conn.execute("PRAGMA user_version=1")
+
+    random.seed(0)
+    start = datetime.now() - timedelta(days=days)
+    source_rows = []
+    page_rows = []
+    for i in range(rows):
+        stamp = (start + timedelta(seconds=random.randrange(days * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+        source_file = f"doc_{i // 10}.pdf"
+        if i % 10 == 0:
+            source_rows.append((source_file, f"input/{source_file}", 1024, random.choice(statuses), stamp, stamp))
+        page_rows.append((f"doc_{i // 10}_{i % 10 + 1}.jpg", source_file, random.choice(statuses), stamp, stamp))
+    conn.executemany('''INSERT INTO SourceFile (source_file, local_file, file_size, status, download_datetime, updated_datetime)
+                        VALUES (?, ?, ?, ?, ?, ?)''', source_rows)
+    conn.executemany('''INSERT INTO ProcessedFile (local_file, source_file, status, image_created_datetime, updated_datetime)
+                        VALUES (?, ?, ?, ?, ?)''', page_rows)
+    conn.commit()
+    return conn
+
+
+def build_page_jobs(conn, rows, days):
+    # PageJob only exists from the migrations on, so its rows are added after the schema upgrade:
+    # one per synthetic page, under the day folder of its timestamp
+    random.seed(1)
+    start = datetime.now() - timedelta(days=days)
+    job_rows = []
+    for i in range(rows):
+        stamp = start + timedelta(seconds=random.randrange(days * 86400))
+        status = random.choice(['pending', 'claimed', 'done', 'failed'])
+        job_rows.append((f"doc_{i // 10}.pdf", stamp.strftime("%y%m%d"), i % 10 + 1, status, 1,
+                         f"doc_{i // 10}_{i % 10 + 1}.jpg", stamp.strftime("%Y-%m-%d %H:%M:%S")))
+    conn.executemany('''INSERT OR IGNORE INTO PageJob (source_file, date_folder, page, status, attempts, local_file, updated_datetime)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', job_rows)
+    conn.commit()
+    return job_rows[rows // 2][:2]
+
+
+def hot_queries(rows, days, page_job):
+    today = datetime.now().strftime("%Y-%m-%d")
+    today_start, today_end = database.day_range(today)
+    first_day = (datetime.now() - timedelta(days=days)).date()
+    threshold = (datetime.now() - timedelta(days=1)).date()
+    range_start = database.day_range(first_day)[0]
+    threshold_end = database.day_range(threshold)[1]
+    source_file = f"doc_{rows // 20}.pdf"
+    job_file, job_folder = page_job
+
+    # (name, query before the indexes, query as the stages now write it, params before, params after)
+    return [
+        ("conversion source_file lookup",
+         "SELECT * FROM SourceFile WHERE source_file=?",
+         "SELECT * FROM SourceFile WHERE source_file=?",
+         (source_file,), (source_file,)),
+        ("input downloaded-today check",
+         "SELECT * FROM SourceFile WHERE source_file=? AND download_datetime LIKE ?",
+         "SELECT * FROM SourceFile WHERE source_file=? AND download_datetime >= ? AND download_datetime < ?",
+         (source_file, f"{today}%"), (source_file, today_start, today_end)),
+        ("demail status count",
+         "SELECT COUNT(*) FROM SourceFile WHERE status = ? AND substr(updated_datetime, 1, 10) = ?",
+         "SELECT COUNT(*) FROM SourceFile WHERE status = ? AND updated_datetime >= ? AND updated_datetime < ?",
+         ('Done', today), ('Done', today_start, today_end)),
+        ("report daily rows",
+         "SELECT * FROM SourceFile WHERE substr(updated_datetime, 1, 10) = ?",
+         "SELECT * FROM SourceFile WHERE updated_datetime >= ? AND updated_datetime < ?",
+         (today,), (today_start, today_end)),
+        ("output pages of a source file",
+         "SELECT COUNT(*) FROM ProcessedFile WHERE source_file=?",
+         "SELECT COUNT(*) FROM ProcessedFile WHERE source_file=?",
+         (source_file,), (source_file,)),
+        ("report status counts",
+         "SELECT status, COUNT(*) FROM SourceFile WHERE substr(updated_datetime, 1, 10) = ? GROUP BY status",
+         "SELECT status, COUNT(*) FROM SourceFile WHERE updated_datetime >= ? AND updated_datetime < ? GROUP BY status",
+         (today,), (today_start, today_end)),
+        # Counted rather than updated so every repeat sees the same rows; delete.mark_folders_deleted
+        # runs the same predicate as an UPDATE
+        ("retention expired sources",
+         "SELECT COUNT(*) FROM SourceFile WHERE status = ? AND DATE(updated_datetime) >= ? AND DATE(updated_datetime) <= ?",
+         "SELECT COUNT(*) FROM SourceFile WHERE status = ? AND updated_datetime >= ? AND updated_datetime < ?",
+         ('Done', str(first_day), str(threshold)), ('Done', range_start, threshold_end)),
+        # PageJob comes with the migrations, so there is no before; the claim of page_jobs.claim_pages
+        ("page job claim",
+         None,
+         "SELECT page FROM PageJob WHERE source_file=? AND date_folder=? AND page >= ? AND page <= ? "
+         "AND status IN (?, ?) ORDER BY page LIMIT ?",
+         None, (job_file, job_folder, 1, 10, 'pending', 'failed', 10)),
+    ]
+
+
+def time_query(conn, query, params, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(query, params).fetchall()
+    return (time.perf_counter() - start_time) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the stages' hot queries on a synthetic DB before and after the schema indexes.")
+    parser.add_argument("--rows", type=int, default=1000000, help="ProcessedFile rows (SourceFile gets one row per 10 pages).")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building synthetic database with {args.rows} ProcessedFile rows...")
+        conn = build_database(os.path.join(tmp, 'bench.db'), args.rows, args.days)
+        before = [time_query(conn, old, old_params, args.repeat) if old else None
+                  for _, old, _, old_params, _ in hot_queries(args.rows, args.days, (None, None))]
+        migrate_start = time.perf_counter()
+        database.ensure_schema(conn)
+        migrate_time = time.perf_counter() - migrate_start
+        queries = hot_queries(args.rows, args.days, build_page_jobs(conn, args.rows, args.days))
+        after = [time_query(conn, new, new_params, args.repeat) for _, _, new, _, new_params in queries]
+        conn.close()
+
+    print(f"Schema upgrade took {migrate_time:.1f}s.")
+    print(f"{'query':<34}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for (name, *_), old_ms, new_ms in zip(queries, before, after):
+        if old_ms is None:
+            print(f"{name:<34}{'-':>12}{new_ms:>12.2f}{'-':>10}")
+        else:
+            print(f"{name:<34}{old_ms:>12.2f}{new_ms:>12.2f}{old_ms / max(new_ms, 1e-6):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
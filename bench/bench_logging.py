@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import logging_setup
+
+
+def log_pages(pages):
+    # One record per page as the page loop would log it; returns the caller-side cost per page in µs
+    start_time = time.perf_counter()
+    for page in range(1, pages + 1):
+        logging.info(f"Saved page {page} of 'bench.pdf'.", extra={'file': 'bench.pdf', 'page': page, 'stage': 'save'})
+    return (time.perf_counter() - start_time) / pages * 1e6
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def bench_direct(pages):
+    # The previous setup: basicConfig writing plain lines to the file from the calling thread
+    reset_root()
+    logging.basicConfig(filename=logging_setup.log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    caller_us = log_pages(pages)
+    reset_root()
+    return caller_us, caller_us
+
+
+def bench_queue(pages, json_logs):
+    # setup_logging(): callers enqueue, the listener thread formats and writes
+    logging_setup.json_logs = json_logs
+    logging_setup.setup_logging()
+    start_time = time.perf_counter()
+    caller_us = log_pages(pages)
+    logging_setup.stop_logging()
+    total_us = (time.perf_counter() - start_time) / pages * 1e6
+    reset_root()
+    return caller_us, total_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of logging one record per page.")
+    parser.add_argument("--pages", type=int, default=50000)
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs(os.path.dirname(logging_setup.log_file), exist_ok=True)
+        for name, run in [('direct text', lambda: bench_direct(args.pages)),
+                          ('queue text', lambda: bench_queue(args.pages, False)),
+                          ('queue json', lambda: bench_queue(args.pages, True))]:
+            caller_us, total_us = run()
+            log_bytes = os.path.getsize(logging_setup.log_file)
+            os.remove(logging_setup.log_file)
+            results.append({'setup': name, 'caller_us_per_page': round(caller_us, 2),
+                            'total_us_per_page': round(total_us, 2), 'bytes_per_page': round(log_bytes / args.pages, 1)})
+
+    print(f"{args.pages} records")
+    print("| setup | caller µs/page | until written µs/page | bytes/page |")
+    print("|---|---|---|---|")
+    for result in results:
+        print(f"| {result['setup']} | {result['caller_us_per_page']} | {result['total_us_per_page']} | {result['bytes_per_page']} |")
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
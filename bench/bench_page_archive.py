@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import page_archive
+from delete import get_folder_usage
+
+
+def make_documents(folder, documents, pages, page_bytes, seed):
+    # documents x pages incompressible page files laid out as processing/<date>/<name>/converted/
+    random.seed(seed)
+    for document in range(1, documents + 1):
+        converted_folder = os.path.join(folder, f"doc_{document:05d}", "converted")
+        os.makedirs(converted_folder)
+        for page in range(1, pages + 1):
+            with open(os.path.join(converted_folder, f"doc_{document:05d}_{page}.jpg"), 'wb') as f:
+                f.write(random.randbytes(page_bytes))
+
+
+def timed(function):
+    start_time = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start_time, result
+
+
+def count_inodes(folder):
+    return sum(len(files) + len(folders) for _, folders, files in os.walk(folder))
+
+
+def read_random_pages(folder, documents, pages, reads, seed):
+    # Pull single pages the way a viewer would, loose or packed
+    random.seed(seed)
+    total_bytes = 0
+    for _ in range(reads):
+        document = random.randint(1, documents)
+        page = random.randint(1, pages)
+        converted_folder = os.path.join(folder, f"doc_{document:05d}", "converted")
+        total_bytes += len(page_archive.read_file(converted_folder, f"doc_{document:05d}_{page}.jpg"))
+    return total_bytes
+
+
+def bench_layout(root, layout, args):
+    # Time the operations that scale with the number of files: packing (archive only), walking for
+    # usage, copying the day as a cross-device move or backup would, reading pages, and purging
+    folder = os.path.join(root, layout)
+    make_documents(folder, args.documents, args.pages, args.page_bytes, args.seed)
+    result = {'layout': layout}
+    result['pack_s'], _ = timed(lambda: [page_archive.pack_document(entry.path) for entry in os.scandir(folder)]) \
+        if layout == 'archive' else (0.0, None)
+    result['inodes'] = count_inodes(folder)
+    result['usage_walk_s'], _ = timed(lambda: get_folder_usage(folder))
+    result['copy_s'], _ = timed(lambda: shutil.copytree(folder, folder + '_copy'))
+    result['read_s'], _ = timed(lambda: read_random_pages(folder, args.documents, args.pages, args.reads, args.seed))
+    result['purge_s'], _ = timed(lambda: (shutil.rmtree(folder), shutil.rmtree(folder + '_copy')))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare loose page files with packed page archives.")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--page-bytes", type=int, default=30000)
+    parser.add_argument("--reads", type=int, default=5000, help="Random single-page reads.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", help="Folder to run in, e.g. on the filesystem that holds processing/.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        results = [bench_layout(tmp, layout, args) for layout in ('files', 'archive')]
+
+    print(f"{args.documents} documents x {args.pages} pages of {args.page_bytes} bytes")
+    print("| layout | inodes | pack s | usage walk s | copy s | read s | purge s |")
+    print("|---|---|---|---|---|---|---|")
+    for result in results:
+        print(f"| {result['layout']} | {result['inodes']} | {result['pack_s']:.3f} | {result['usage_walk_s']:.3f} | "
+              f"{result['copy_s']:.3f} | {result['read_s']:.3f} | {result['purge_s']:.3f} |")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+repo_folder = os.path.join(bench_folder, '..')
+sys.path.insert(0, repo_folder)
+sys.path.insert(0, bench_folder)
+import database
+import make_corpus
+
+# Every run gets a fresh working directory and conversion.db, so results only depend on the
+# corpus settings and the code under test. Stages run in order, each on the previous one's output.
+stages = ['convert', 'db_write', 'complete', 'retention', 'report']
+
+# Source file of the db_write stage's synthetic ProcessedFile rows, which have no pages on disk
+synthetic_source_file = "bench.pdf"
+
+# Statements executed on any connection opened through database.connect, for DB ops/sec
+db_ops = {'count': 0}
+
+
+def count_db_ops():
+    original_connect = database.connect
+
+    def connect(path=None):
+        conn = original_connect(path)
+        conn.set_trace_callback(lambda statement: db_ops.__setitem__('count', db_ops['count'] + 1))
+        return conn
+    database.connect = connect
+
+
+def measure(name, function):
+    # Run one stage; function returns the number of pages it handled. Peak RSS is this process's,
+    # so with --workers above 1 it leaves out the conversion pool.
+    import conversion
+    conversion.reset_peak_rss()
+    ops_before = db_ops['count']
+    start_time = time.perf_counter()
+    pages = function()
+    elapsed = time.perf_counter() - start_time
+    ops = db_ops['count'] - ops_before
+    return {
+        'stage': name,
+        'seconds': round(elapsed, 4),
+        'pages': pages,
+        'pages_per_sec': round(pages / elapsed, 1) if elapsed > 0 else None,
+        'peak_rss_mb': round(conversion.get_peak_rss_mb(), 1),
+        'db_ops': ops,
+        'db_ops_per_sec': round(ops / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def count_pages(conn):
+    return conn.execute('''SELECT COUNT(*) FROM ProcessedFile''').fetchone()[0]
+
+
+def run_stages(args, corpus):
+    # Import the pipeline modules inside the working directory: they resolve their folders relative to it
+    import logging_setup
+    import conversion
+    import output
+    import delete
+    import report
+    logging_setup.setup_logging()
+
+    today = datetime.now().strftime("%y%m%d")
+    input_folder_today = os.path.join(conversion.input_folder, today)
+    os.makedirs(input_folder_today)
+    for path in corpus:
+        shutil.copy(path, input_folder_today)
+    conn = database.get_connection()
+    for path in corpus:
+        conn.execute('''INSERT INTO SourceFile (source_file, status, download_datetime, updated_datetime)
+                        VALUES (?, ?, ?, ?)''', (os.path.basename(path), 'pending', *[datetime.now().strftime("%Y-%m-%d %H:%M:%S")] * 2))
+    conn.commit()
+
+    def convert():
+        conversion.process_pdf_files(workers=args.workers)
+        return count_pages(database.get_connection())
+
+    def db_write():
+        # The ProcessedFile write path on its own, with synthetic rows in db_batch_size transactions
+        conn = database.get_connection()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(f"bench_{page}.jpg", synthetic_source_file, 'Processing', now, now, 0, None, None, 0.0) for page in range(1, args.db_rows + 1)]
+        for start in range(0, len(rows), conversion.db_batch_size or len(rows)):
+            conversion.insert_processed_files(conn.cursor(), conn, rows[start:start + (conversion.db_batch_size or len(rows))],
+                                              datetime.now().strftime("%y%m%d"))
+        return len(rows)
+
+    def complete():
+        pages = count_pages(database.get_connection())
+        output.move_files_to_completed()
+        return pages
+
+    def retention():
+        # Age today's output past the retention window, then sweep it
+        conn = database.get_connection()
+        pages = count_pages(conn)
+        old_day = datetime.now() - timedelta(days=delete.completed_retention_days + 1)
+        os.rename(os.path.join(output.completed_folder, today), os.path.join(output.completed_folder, old_day.strftime("%y%m%d")))
+        conn.execute('''UPDATE SourceFile SET updated_datetime=? WHERE status=?''', (old_day.strftime("%Y-%m-%d %H:%M:%S"), 'Done'))
+        conn.commit()
+        delete.move_processed_folders_to_deleted()
+        return pages
+
+    def report_export():
+        report.export_source_file_data(args.report_format)
+        return len(corpus)
+
+    functions = {'convert': convert, 'db_write': db_write, 'complete': complete, 'retention': retention, 'report': report_export}
+    results = []
+    for name in stages:
+        results.append(measure(name, functions[name]))
+        if name == 'db_write':
+            # Later stages count and move the corpus's pages only
+            conn = database.get_connection()
+            conn.execute('''DELETE FROM ProcessedFile WHERE source_file=?''', (synthetic_source_file,))
+            conn.commit()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_folder, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def markdown_table(results, baseline=None):
+    baseline_stages = {result['stage']: result for result in (baseline or {}).get('stages', [])}
+    header = "| stage | seconds | pages | pages/sec | peak RSS MB | DB ops | DB ops/sec |"
+    if baseline_stages:
+        header += " vs baseline |"
+    lines = [header, "|" + "---|" * (header.count("|") - 1)]
+    for result in results:
+        line = (f"| {result['stage']} | {result['seconds']:.3f} | {result['pages']} | {result['pages_per_sec']} | "
+                f"{result['peak_rss_mb']} | {result['db_ops']} | {result['db_ops_per_sec']} |")
+        previous = baseline_stages.get(result['stage'])
+        if baseline_stages:
+            change = (result['seconds'] / previous['seconds'] - 1) * 100 if previous and previous['seconds'] else None
+            line += f" {change:+.1f}% |" if change is not None else " n/a |"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run each pipeline stage against a synthetic corpus and a scratch conversion.db.")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--min-pages", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--image-ratio", type=float, default=0.3)
+    parser.add_argument("--image-size", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--db-rows", type=int, default=5000, help="Synthetic rows for the db_write stage.")
+    parser.add_argument("--report-format", choices=['xlsx', 'csv', 'parquet'], default='csv')
+    parser.add_argument("--dir", default=None, help="Parent of the scratch working directory (use the production mount for realistic I/O).")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Exit non-zero if a stage is this many percent slower than the baseline.")
+    args = parser.parse_args()
+
+    count_db_ops()
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        corpus = make_corpus.make_corpus(os.path.join(tmp, 'corpus'), args.files, args.min_pages, args.max_pages,
+                                         args.image_ratio, args.image_size, 0.5, args.seed)
+        working_folder = os.path.join(tmp, 'work')
+        os.makedirs(working_folder)
+        os.chdir(working_folder)
+        try:
+            results = run_stages(args, corpus)
+        finally:
+            database.close_connection()
+            os.chdir(repo_folder)
+
+    summary = {
+        'revision': git_revision(),
+        'run_datetime': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'settings': vars(args),
+        'stages': results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(markdown_table(results, baseline))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if baseline:
+        baseline_stages = {result['stage']: result for result in baseline['stages']}
+        regressions = [result['stage'] for result in results
+                       if result['stage'] in baseline_stages and baseline_stages[result['stage']]['seconds']
+                       and (result['seconds'] / baseline_stages[result['stage']]['seconds'] - 1) * 100 > args.max_regression]
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+repo_folder = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# The commands cron and the pipeline launch
+commands = ['input', 'conversion', 'output', 'delete', 'report', 'demail', 'pipeline', 'catchup', 'database']
+
+
+def time_import(module, runs):
+    # Median wall time of a fresh interpreter importing the module, in ms
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            subprocess.run([sys.executable, '-c', f"import {module}"], cwd=tmp, check=True,
+                           env=dict(os.environ, PYTHONPATH=repo_folder), capture_output=True)
+            samples.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(samples)
+
+
+def slowest_imports(module, count):
+    # The heaviest imports behind the module, by cumulative time from python -X importtime
+    with tempfile.TemporaryDirectory() as tmp:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=tmp,
+                                env=dict(os.environ, PYTHONPATH=repo_folder), capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() != module:
+            timings.append((int(cumulative), name.strip()))
+    return sorted(timings, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold-start import time of each command.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=3, help="Heaviest imports listed per command.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    baseline = time_import('os', args.runs)
+    results = []
+    print(f"interpreter start: {baseline:.1f} ms")
+    print("| command | import ms | over bare interpreter ms | heaviest imports |")
+    print("|---|---|---|---|")
+    for command in commands:
+        elapsed = time_import(command, args.runs)
+        heaviest = slowest_imports(command, args.top)
+        results.append({'command': command, 'import_ms': round(elapsed, 1),
+                        'heaviest': [{'module': name, 'us': us} for us, name in heaviest]})
+        listed = ", ".join(f"{name} {us / 1000:.1f}ms" for us, name in heaviest)
+        print(f"| {command} | {elapsed:.1f} | {elapsed - baseline:.1f} | {listed} |")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'interpreter_ms': round(baseline, 1), 'commands': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
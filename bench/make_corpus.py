@@ -0,0 +1,109 @@
+import os
+import zlib
+import random
+import argparse
+
+# A4 in PDF points
+page_width = 595
+page_height = 842
+
+words = ("invoice order account payment balance total amount customer reference date period statement "
+         "shipment delivery quantity price tax discount summary page report schedule contract").split()
+
+
+def text_content(rng, page):
+    # A page of Helvetica text lines
+    lines = [f"Synthetic page {page}"]
+    for _ in range(60):
+        lines.append(" ".join(rng.choice(words) for _ in range(rng.randint(6, 12))))
+    stream = ["BT /F1 10 Tf 12 TL 50 800 Td"]
+    for line in lines:
+        stream.append(f"({line}) Tj T*")
+    stream.append("ET")
+    return "\n".join(stream).encode()
+
+
+def image_data(rng, width, height, noise):
+    # RGB bands with a share of random noise; noise does not compress, so it sets the file size
+    rows = []
+    for y in range(height):
+        if rng.random() < noise:
+            rows.append(rng.randbytes(width * 3))
+        else:
+            shade = (y * 255 // max(1, height - 1)) & 0xFF
+            rows.append(bytes((shade, (shade + 85) & 0xFF, (shade + 170) & 0xFF)) * width)
+    return zlib.compress(b"".join(rows))
+
+
+def write_pdf(path, rng, pages, image_ratio, image_size, noise):
+    # Hand-written PDF 1.4: catalog, page tree, one font, then a content stream (and an image) per page
+    objects = {1: None, 2: None, 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    page_ids = []
+    next_id = 4
+    for page in range(1, pages + 1):
+        page_id, content_id = next_id, next_id + 1
+        next_id += 2
+        resources = "/Font << /F1 3 0 R >>"
+        if rng.random() < image_ratio:
+            image_id = next_id
+            next_id += 1
+            data = image_data(rng, image_size, image_size, noise)
+            objects[image_id] = (f"<< /Type /XObject /Subtype /Image /Width {image_size} /Height {image_size} "
+                                 f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+                                 f"/Length {len(data)} >>\nstream\n").encode() + data + b"\nendstream"
+            resources += f" /XObject << /Im1 {image_id} 0 R >>"
+            content = f"q 495 0 0 700 50 70 cm /Im1 Do Q\nBT /F1 12 Tf 50 800 Td (Synthetic image page {page}) Tj ET".encode()
+        else:
+            content = text_content(rng, page)
+        objects[content_id] = f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream"
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+                            f"/Resources << {resources} >> /Contents {content_id} 0 R >>").encode()
+        page_ids.append(page_id)
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>".encode()
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = f.tell()
+            f.write(f"{object_id} 0 obj\n".encode() + objects[object_id] + b"\nendobj\n")
+        xref_offset = f.tell()
+        f.write(f"xref\n0 {next_id}\n0000000000 65535 f \n".encode())
+        for object_id in range(1, next_id):
+            f.write(f"{offsets[object_id]:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+def make_corpus(folder, files, min_pages, max_pages, image_ratio, image_size, noise, seed=0):
+    # Write files PDFs with a seeded mix of page counts, text and image pages; returns their paths
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = os.path.join(folder, f"synthetic_{i + 1:04d}.pdf")
+        write_pdf(path, rng, rng.randint(min_pages, max_pages), image_ratio, image_size, noise)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a reproducible corpus of synthetic PDFs.")
+    parser.add_argument("folder")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--min-pages", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=40)
+    parser.add_argument("--image-ratio", type=float, default=0.3, help="Share of pages that carry a full-page image.")
+    parser.add_argument("--image-size", type=int, default=600, help="Width and height of page images in pixels.")
+    parser.add_argument("--noise", type=float, default=0.5, help="Share of incompressible image rows (drives file size).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = make_corpus(args.folder, args.files, args.min_pages, args.max_pages, args.image_ratio,
+                        args.image_size, args.noise, args.seed)
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    print(f"Wrote {len(paths)} PDFs ({total_bytes / 1048576:.1f} MB) to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import time
+import shutil
+import filecmp
+import logging
+import argparse
+from datetime import datetime, timedelta
+import database
+import logging_setup
+import metrics
+import conversion
+import output
+import placement
+import page_jobs
+
+# Works through every file the SourceFile table says is unfinished, whatever date folder it is in,
+# oldest download first: files not converted yet, files converted but not moved to completed, and
+# failed files that are due a retry. Each file is converted under its own <yymmdd> folder and
+# completed into today's, so retention counts from when it completed.
+
+# Statuses with work left
+outstanding_statuses = ('pending', 'processing', 'Failed', 'Completed')
+
+# A 'processing' row not updated for this long belongs to a run that stopped, unless its page jobs
+# show a conversion still going
+stale_processing_minutes = 60
+
+# A failed file is retried after retry_base_seconds, doubling with each attempt up to
+# retry_max_seconds, until it has failed max_attempts times
+retry_base_seconds = 300
+retry_max_seconds = 6 * 3600
+max_attempts = 5
+
+# Pre-scan results no retry can change
+permanent_scan_statuses = ('corrupt', 'encrypted', 'empty')
+
+# Where conversion.move_to_failed leaves a failed file's folder, original PDF included
+failed_folder = "failed"
+
+
+def get_outstanding(conn, now):
+    # (source_file, local_file, status) of the latest row per file that has work due, oldest first
+    now_text = now.strftime("%Y-%m-%d %H:%M:%S")
+    stale_text = (now - timedelta(minutes=stale_processing_minutes)).strftime("%Y-%m-%d %H:%M:%S")
+    return conn.execute('''SELECT source_file, local_file, status FROM SourceFile
+                           WHERE status IN (?, ?, ?, ?)
+                           AND (status != ? OR updated_datetime < ?)
+                           AND (next_attempt_datetime IS NULL OR next_attempt_datetime <= ?)
+                           AND COALESCE(attempts, 0) < ?
+                           AND (scan_status IS NULL OR scan_status NOT IN (?, ?, ?))
+                           AND id IN (SELECT MAX(id) FROM SourceFile GROUP BY source_file)
+                           ORDER BY COALESCE(download_datetime, updated_datetime), id''',
+                        (*outstanding_statuses, 'processing', stale_text, now_text, max_attempts,
+                         *permanent_scan_statuses)).fetchall()
+
+
+def get_next_retry(conn, now):
+    # When the next failed file becomes due, or None if no retries are left
+    row = conn.execute('''SELECT MIN(next_attempt_datetime) FROM SourceFile
+                          WHERE status=? AND COALESCE(attempts, 0) < ? AND next_attempt_datetime > ?
+                          AND (scan_status IS NULL OR scan_status NOT IN (?, ?, ?))''',
+                       ('Failed', max_attempts, now.strftime("%Y-%m-%d %H:%M:%S"), *permanent_scan_statuses)).fetchone()
+    return datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S") if row and row[0] else None
+
+
+def record_failure(conn, file_name, now):
+    # Count the attempt and schedule the next one with exponential backoff
+    attempts = conn.execute('''SELECT COALESCE(MAX(attempts), 0) FROM SourceFile WHERE source_file=?''',
+                            (file_name,)).fetchone()[0] + 1
+    delay = min(retry_base_seconds * 2 ** (attempts - 1), retry_max_seconds)
+    next_attempt = (now + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute('''UPDATE SourceFile SET attempts=?, next_attempt_datetime=? WHERE source_file=?''',
+                 (attempts, next_attempt, file_name))
+    conn.commit()
+    if attempts >= max_attempts:
+        logging.error(f"Giving up on '{file_name}' after {attempts} failed attempts.")
+    else:
+        logging.info(f"'{file_name}' failed (attempt {attempts} of {max_attempts}), next retry after {next_attempt}.")
+
+
+def restore_failed_original(local_file):
+    # output.delete_input_folder_contents clears input/ after a run, so a failed file's PDF may only
+    # be left in failed/<name>/original; put it back where it was downloaded so it converts under its
+    # own date folder. Returns whether a copy was found.
+    file_name = os.path.basename(local_file)
+    failed_copy = os.path.join(failed_folder, os.path.splitext(file_name)[0], "original", file_name)
+    if not os.path.isfile(failed_copy):
+        return False
+    try:
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        placement.place_file(failed_copy, local_file, source_file=file_name)
+    except OSError as e:
+        logging.error(f"Error restoring '{file_name}' from the failed folder: {str(e)}")
+        return False
+    logging.info(f"Restored '{file_name}' to {local_file} from the failed folder.")
+    return True
+
+
+def restore_failed_pages(local_file):
+    # move_to_failed takes a failed attempt's folder to failed/<name>, pages already rendered and all.
+    # Put it back under processing/<yymmdd>/<name> before the retry: those pages' PageJob rows are still
+    # done, so the retry keeps them and renders only the rest, and nothing stale is left in failed/.
+    # Files a later attempt already left in processing win. failed/ is keyed by name alone, so this
+    # is only done when the failed folder's original is this download. Returns the files moved back.
+    file_name = os.path.basename(local_file)
+    file_name_no_extension = os.path.splitext(file_name)[0]
+    failed_path = os.path.join(failed_folder, file_name_no_extension)
+    failed_copy = os.path.join(failed_path, "original", file_name)
+    processing_path = os.path.join(conversion.processing_folder, conversion.get_date_folder(local_file), file_name_no_extension)
+    restored = 0
+    try:
+        if not os.path.isfile(failed_copy) or not filecmp.cmp(failed_copy, local_file, shallow=False):
+            return 0
+        for root, _, files in os.walk(failed_path):
+            target_root = os.path.join(processing_path, os.path.relpath(root, failed_path))
+            os.makedirs(target_root, exist_ok=True)
+            for file in files:
+                if not os.path.exists(os.path.join(target_root, file)):
+                    os.rename(os.path.join(root, file), os.path.join(target_root, file))
+                    restored += 1
+        shutil.rmtree(failed_path)
+    except OSError as e:
+        logging.error(f"Error restoring the rendered pages of '{file_name}' from the failed folder: {str(e)}")
+        return restored
+    logging.info(f"Moved {restored} file(s) of '{file_name}' back from the failed folder for its retry.")
+    return restored
+
+
+def conversion_in_progress(conn, file_name, date_folder, now):
+    # The SourceFile row is only updated when the status changes, so a long conversion looks stale.
+    # Its PageJob rows are claimed and finished chunk by chunk and show whether it is still going.
+    if page_jobs.get_live_claims(conn, file_name, date_folder):
+        return True
+    last_update = page_jobs.get_last_update(conn, file_name, date_folder)
+    stale_text = (now - timedelta(minutes=stale_processing_minutes)).strftime("%Y-%m-%d %H:%M:%S")
+    return last_update is not None and last_update >= stale_text
+
+
+def get_status(conn, file_name):
+    row = conn.execute('''SELECT status FROM SourceFile WHERE source_file=? ORDER BY id DESC LIMIT 1''', (file_name,)).fetchone()
+    return row[0] if row else None
+
+
+def catch_up_pass(conn, workers, totals):
+    # Convert and complete everything due now; returns the number of files attempted
+    now = datetime.now()
+    to_convert = []
+    to_complete = []
+    date_folders = set()
+    for source_file, local_file, status in get_outstanding(conn, now):
+        if not local_file:
+            logging.info(f"Skipping '{source_file}', its download location is not recorded.")
+            continue
+        date_folder = conversion.get_date_folder(local_file)
+        if status == 'processing' and conversion_in_progress(conn, source_file, date_folder, now):
+            logging.info(f"Skipping '{source_file}', another process is still converting it.")
+            continue
+        date_folders.add(date_folder)
+        if status == 'Completed':
+            to_complete.append(local_file)
+        elif os.path.isfile(local_file) or restore_failed_original(local_file):
+            restore_failed_pages(local_file)
+            to_convert.append(local_file)
+        else:
+            # Counted as a failed attempt, so a file that is gone for good is given up on
+            totals['missing'] += 1
+            logging.error(f"Cannot retry '{source_file}', {local_file} no longer exists.")
+            record_failure(conn, source_file, now)
+    if not to_convert and not to_complete:
+        return 0
+    logging.info(f"Catching up {len(to_convert)} file(s) to convert and {len(to_complete)} to complete "
+                 f"across {len(date_folders)} date folder(s), oldest {min(date_folders)}.")
+
+    # Oldest first; the pre-scan still fails unreadable files before any rendering
+    pdf_files, page_counts = conversion.schedule_files(to_convert, order='listing')
+    if workers > 1:
+        totals['pages'] += conversion.process_pdf_files_parallel(pdf_files, workers, page_counts)
+    else:
+        for input_file in pdf_files:
+            totals['pages'] += conversion.convert_pdf_to_images(input_file, conversion.processing_folder)
+
+    for input_file in to_convert + to_complete:
+        file_name = os.path.basename(input_file)
+        status = get_status(conn, file_name)
+        if status == 'Completed':
+            if output.complete_file(input_file, conversion.get_date_folder(input_file)):
+                totals['completed'] += 1
+        elif status == 'Failed':
+            totals['failed'] += 1
+            record_failure(conn, file_name, now)
+    return len(to_convert) + len(to_complete)
+
+
+def run_catchup(workers=1, wait=False):
+    # One pass over the backlog, or with wait, passes until nothing is left but files out of retries
+    totals = {'attempted': 0, 'pages': 0, 'completed': 0, 'failed': 0, 'missing': 0}
+    start_time = time.monotonic()
+    try:
+        conn = database.get_connection()
+        while True:
+            totals['attempted'] += catch_up_pass(conn, workers, totals)
+            if not wait:
+                break
+            next_retry = get_next_retry(conn, datetime.now())
+            if next_retry is None:
+                break
+            delay = max(0, (next_retry - datetime.now()).total_seconds())
+            logging.info(f"Waiting {delay:.0f}s for the next retry.")
+            time.sleep(delay)
+        if totals['attempted']:
+            logging.info(f"Catch-up attempted {totals['attempted']} file(s) in {time.monotonic() - start_time:.1f}s: "
+                         f"{totals['completed']} completed ({totals['pages']} pages converted), {totals['failed']} failed, "
+                         f"{totals['missing']} missing.")
+    except Exception as e:
+        logging.error(f"Error catching up: {str(e)}")
+    finally:
+        metrics.write_textfile()
+    return totals
+
+
+def main():
+    global max_attempts, retry_base_seconds
+    parser = argparse.ArgumentParser(description="Convert and complete every outstanding file recorded in the database, oldest first.")
+    parser.add_argument("--workers", type=int, default=conversion.default_workers, help="Number of conversion processes.")
+    parser.add_argument("--wait", action="store_true", help="Keep going until only files out of retries are left.")
+    parser.add_argument("--max-attempts", type=int, default=max_attempts, help="Failed attempts before a file is given up on.")
+    parser.add_argument("--retry-base-seconds", type=int, default=retry_base_seconds, help="Delay before the first retry; doubles per attempt.")
+    args = parser.parse_args()
+    max_attempts = max(1, args.max_attempts)
+    retry_base_seconds = max(0, args.retry_base_seconds)
+    logging_setup.setup_logging()
+
+    run_catchup(max(1, args.workers), args.wait)
+    database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
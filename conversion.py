@@ -1,141 +1,747 @@
 import os
+import time
 import shutil
-import subprocess
-import sqlite3
 import logging
+import argparse
+import resource
 from datetime import datetime
-from pdf2image import convert_from_path
-
-# Set up logging
-log_file = 'logs/pdf_convert.log'
-os.makedirs(os.path.dirname(log_file), exist_ok=True)
-logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import database
+import logging_setup
+import render_cache
+import render_profiles
+import page_jobs
+import page_archive
+import placement
+import governor
+import metrics
 
 input_folder = "input/"
 processing_folder = "processing/"
 
-def convert_pdf_to_images(input_file, output_folder):
+# Parallel conversion settings
+default_workers = os.cpu_count() or 1
+split_page_threshold = 200  # PDFs with more pages than this are split into page ranges
+pages_per_range = 50
+
+# Pages rendered per pdf2image call; bounds how many PIL images are held in memory at once
+render_chunk_size = 10
+
+# ProcessedFile rows written per transaction (0 writes a whole file or page range in one transaction)
+db_batch_size = 100
+
+# 'link' places each original in processing/.../original/ when its conversion starts; 'defer' renders
+# from the downloaded file and lets output.py move it into original/ when the file completes
+original_placement = 'link'
+
+# 'files' keeps one image file per page; 'archive' packs each completed document's output folders
+# into stored zips (see page_archive.py), so moving and purging it touches a few files, not every page
+page_storage = 'files'
+
+# Order a batch is converted in after the pre-scan: 'sjf' (fewest pages first, so small files are
+# not stuck behind a huge one), 'lpt' (most pages first) or 'listing' (folder order)
+schedule_order = 'sjf'
+
+
+def update_source_file_status(cursor, file_name, status):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute('''SELECT * FROM SourceFile WHERE source_file=?''', (file_name,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute('''UPDATE SourceFile
+                          SET status=?, updated_datetime=?
+                          WHERE source_file=?''',
+                       (status, now, file_name))
+    else:
+        cursor.execute('''INSERT INTO SourceFile (source_file, status, updated_datetime)
+                          VALUES (?, ?, ?)''', (file_name, status, now))
+
+
+def prescan_file(conn, input_file):
+    # Read page count, page size and encryption with pdfinfo, which parses the PDF without rendering
+    # it, and store them on the SourceFile row. Returns (page_count, scan_status); page_count is None
+    # for a file that cannot be rendered. A scan is reused for any file with the same content hash.
+    from pdf2image import pdfinfo_from_path
+    file_name = os.path.basename(input_file)
+    file_size = os.path.getsize(input_file)
+    content_hash = get_content_hash(conn, input_file)
+    row = conn.execute('''SELECT page_count, page_size, encrypted, scan_status FROM SourceFile
+                          WHERE content_hash=? AND scan_status IS NOT NULL ORDER BY id DESC LIMIT 1''', (content_hash,)).fetchone()
+    if row:
+        page_count, page_size, encrypted, scan_status = row
+    else:
+        page_count = None
+        page_size = None
+        encrypted = None
+        try:
+            with metrics.timed('prescan', file_name):
+                info = pdfinfo_from_path(input_file)
+            page_count = int(info["Pages"]) or None
+            page_size = info.get("Page size")
+            encrypted = int(str(info.get("Encrypted", "no")).startswith("yes"))
+            scan_status = 'ok' if page_count else 'empty'
+        except Exception as e:
+            scan_status = 'encrypted' if 'password' in str(e).lower() else 'corrupt'
+            logging.error(f"Rejected '{file_name}' before rendering ({scan_status}): {str(e)}", extra={'file': file_name, 'stage': 'prescan'})
+
+    # Recorded on this download's row either way, for the scheduler and catch-up
+    cursor = conn.cursor()
+    if cursor.execute('''SELECT 1 FROM SourceFile WHERE source_file=?''', (file_name,)).fetchone() is None:
+        update_source_file_status(cursor, file_name, 'pending')
+    cursor.execute('''UPDATE SourceFile SET file_size=?, content_hash=?, page_count=?, page_size=?, encrypted=?, scan_status=?
+                      WHERE id=(SELECT MAX(id) FROM SourceFile WHERE source_file=?)''',
+                   (file_size, content_hash, page_count, page_size, encrypted, scan_status, file_name))
+    conn.commit()
+    return page_count, scan_status
+
+
+def get_content_hash(conn, input_file):
+    # The hash input.py recorded when it downloaded this file, or the file's hash worked out now
+    row = conn.execute('''SELECT content_hash FROM SourceFile WHERE source_file=? AND local_file=? AND content_hash IS NOT NULL
+                          ORDER BY id DESC LIMIT 1''', (os.path.basename(input_file), os.path.relpath(input_file))).fetchone()
+    return row[0] if row else render_cache.hash_file(input_file)
+
+
+def schedule_files(pdf_files, order=None):
+    # Pre-scan a batch, fail the files that cannot be rendered and order the rest.
+    # Returns the files to convert and their page counts.
+    order = order or schedule_order
+    conn = database.get_connection()
+    scanned = []
+    for input_file in pdf_files:
+        page_count, scan_status = prescan_file(conn, input_file)
+        if page_count is None:
+            update_source_file_status(conn.cursor(), os.path.basename(input_file), 'Failed')
+            conn.commit()
+            continue
+        scanned.append((page_count, input_file))
+    if order == 'sjf':
+        scanned.sort()
+    elif order == 'lpt':
+        scanned.sort(reverse=True)
+    if len(scanned) < len(pdf_files):
+        logging.info(f"Rejected {len(pdf_files) - len(scanned)} of {len(pdf_files)} files in the pre-scan.")
+    return [input_file for _, input_file in scanned], {input_file: page_count for page_count, input_file in scanned}
+
+
+def get_date_folder(input_file):
+    # The <yymmdd> folder a file was downloaded into, so a file converted after midnight or by a
+    # catch-up run stays under its own day; today for files outside a date folder
+    date_folder = os.path.basename(os.path.dirname(os.path.abspath(input_file)))
+    try:
+        datetime.strptime(date_folder, "%y%m%d")
+        return date_folder
+    except ValueError:
+        return datetime.now().strftime("%y%m%d")
+
+
+def prepare_file_folder(input_file, output_folder):
+    # Create folder for the input file
+    file_name = os.path.basename(input_file)
+    file_name_no_extension = os.path.splitext(file_name)[0]
+    file_folder = os.path.join(output_folder, get_date_folder(input_file), file_name_no_extension)
+    os.makedirs(file_folder, exist_ok=True)  # Create folder for original PDF file
+    os.makedirs(os.path.join(file_folder, "converted"), exist_ok=True)  # Create folder for converted images
+
+    # Create original folder and link the original PDF file into it; pages are always rendered from
+    # input_file itself, so with 'defer' nothing is placed until the file completes
+    original_folder = os.path.join(file_folder, "original")
+    os.makedirs(original_folder, exist_ok=True)
+    if original_placement == 'link':
+        placement.place_original(input_file, file_folder)
+    return file_folder
+
+
+def move_to_failed(file_name, date_folder=None):
+    try:
+        today_date = date_folder or datetime.now().strftime("%y%m%d")
+        file_name_no_extension = os.path.splitext(file_name)[0]
+        error_file_folder = os.path.join(processing_folder, today_date, file_name_no_extension)
+        failed_folder = os.path.join(os.getcwd(), "failed")
+        if not os.path.exists(failed_folder):
+            os.makedirs(failed_folder)
+        input_file = os.path.join(input_folder, today_date, file_name)
+        if os.path.exists(error_file_folder) and os.path.isfile(input_file):
+            # With a deferred original the failed folder would otherwise have no copy of the PDF
+            placement.place_original(input_file, error_file_folder)
+        if os.path.exists(error_file_folder):
+            # A retried file replaces the output of its previous failed attempt
+            shutil.rmtree(os.path.join(failed_folder, file_name_no_extension), ignore_errors=True)
+            shutil.move(error_file_folder, failed_folder)
+            logging.info(f"Error file '{file_name}' moved to 'failed' folder.")
+    except Exception as e:
+        logging.error(f"Error moving error file to 'Failed' folder: {str(e)}")
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM on Linux so the next reading covers only the current file
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def get_peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Fall back to the process-lifetime peak where /proc is not available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def insert_processed_files(cursor, conn, rows, date_folder):
+    # Write a batch of ProcessedFile rows and mark their pages done in a single transaction
+    if not rows:
+        return
+    with metrics.timed('db', rows[0][1]) as sample:
+        cursor.executemany('''INSERT INTO ProcessedFile
+                              (local_file, source_file, status, image_created_datetime, updated_datetime,
+                              file_size, thumbnail_size, extra_size, encode_ms)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        last_id = cursor.execute('''SELECT last_insert_rowid()''').fetchone()[0]
+        page_jobs.mark_done(cursor, rows[0][1], date_folder, [row[0] for row in rows], last_id - len(rows) + 1)
+        conn.commit()
+        sample['pages'] = len(rows)
+
+
+def get_cache_key(input_file, settings):
+    # The profile settings are part of the key, so each profile keeps its own cached rendering
+    if not render_cache.enabled():
+        return None
+    return render_cache.get_cache_key(input_file, settings)
+
+
+def record_render_profile(cursor, file_name, profile_name):
+    cursor.execute('''UPDATE SourceFile SET render_profile=? WHERE source_file=?''', (profile_name, file_name))
+
+
+def restore_from_cache(conn, cache_key, file_name, file_folder, settings):
+    # Link previously rendered pages of an identical PDF into converted/; returns the page count or None.
+    # The cache holds only the main images, so thumbnails and extra formats are rebuilt from them.
+    file_name_no_extension = os.path.splitext(file_name)[0]
+    with metrics.timed('cache_restore', file_name) as sample:
+        restored = render_cache.restore(conn, cache_key, os.path.join(file_folder, "converted"), file_name_no_extension)
+        sample['pages'] = len(restored) if restored is not None else 0
+    render_cache.record_cache_result(conn, file_name, restored is not None)
+    if restored is None:
+        return None
+    # Pages an earlier, interrupted run of this download already recorded keep their rows
+    date_folder = os.path.basename(os.path.dirname(file_folder))
+    page_jobs.create_jobs(conn, file_name, date_folder, len(restored))
+    done_pages = page_jobs.get_done_pages(conn, file_name, date_folder)
+    converted_folder = os.path.join(file_folder, "converted")
+    render_profiles.prepare_output_folders(file_folder, settings)
+    rows = []
+    for page_file in restored:
+        if page_jobs.page_number(page_file) in done_pages:
+            continue
+        image_path = os.path.join(converted_folder, page_file)
+        thumbnail_size, extra_size, encode_ms = None, None, None
+        if render_profiles.has_extra_outputs(settings):
+            start_time = time.perf_counter()
+            thumbnail_size, extra_size = render_profiles.save_extra_outputs_from_file(
+                image_path, file_folder, os.path.splitext(page_file)[0], settings)
+            encode_ms = (time.perf_counter() - start_time) * 1000
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows.append((page_file, file_name, 'Processing', now, now, os.path.getsize(image_path), thumbnail_size, extra_size, encode_ms))
+    insert_processed_files(conn.cursor(), conn, rows, date_folder)
+    logging.info(f"Restored {len(restored)} pages of '{file_name}' from the render cache.")
+    return len(restored)
+
+
+def pack_pages(file_name, file_folder):
+    # With the archive page storage, pack a completed document's output folders into one file each
+    if page_storage != 'archive':
+        return
+    try:
+        with metrics.timed('pack', file_name) as sample:
+            sample['pages'] = page_archive.pack_document(file_folder)
+    except Exception as e:
+        logging.error(f"Error packing pages of '{file_name}': {str(e)}")
+
+
+def store_in_cache(conn, cache_key, file_name, file_folder):
+    try:
+        render_cache.store(conn, cache_key, file_name, os.path.join(file_folder, "converted"), os.path.splitext(file_name)[0])
+    except Exception as e:
+        logging.error(f"Error adding '{file_name}' to the render cache: {str(e)}")
+
+
+def render_pages(input_file, file_folder, cursor, conn, settings, first_page=None, last_page=None):
+    from pdf2image import convert_from_path
+    file_name = os.path.basename(input_file)
+    file_name_no_extension = os.path.splitext(file_name)[0]
+    date_folder = get_date_folder(input_file)
+    first_page = first_page or 1
+    if last_page is None:
+        last_page = get_page_count(input_file)
+        if last_page is None:
+            raise ValueError(f"Could not read page count of '{file_name}'")
+
+    # Convert PDF to images using pdf2image, a chunk at a time so memory is bounded by the chunk size.
+    # Each chunk is claimed in PageJob first, so pages that are done or held by another worker are skipped.
+    convert_options = render_profiles.get_convert_options(settings)
+    render_profiles.prepare_output_folders(file_folder, settings)
+    page_count = 0
+    rows = []
+
+    def encode_page(page, image):
+        # Write every output of one page from its bitmap, then free the bitmap
+        with metrics.timed('save', file_name, page) as sample:
+            outputs = render_profiles.save_outputs(image, file_folder, f"{file_name_no_extension}_{page}", settings)
+            sample['bytes'] = outputs[1] + (outputs[2] or 0) + (outputs[3] or 0)
+            sample['pages'] = 1
+        image.close()
+        return outputs
+
+    with ThreadPoolExecutor(max_workers=max(1, settings['encode_threads'])) as encoder:
+        while True:
+            claimed = page_jobs.claim_pages(conn, file_name, date_folder, first_page, last_page, render_chunk_size)
+            if not claimed:
+                break
+            try:
+                for run_start, run_end in page_jobs.contiguous_runs(claimed):
+                    with metrics.timed('render', file_name, run_start) as sample:
+                        images = convert_from_path(input_file, first_page=run_start, last_page=run_end, **convert_options)
+                        sample['pages'] = len(images)
+                    if len(images) != run_end - run_start + 1:
+                        raise ValueError(f"Rendered {len(images)} images for pages {run_start}-{run_end} of '{file_name}'")
+
+                    # Encode the run's pages on the encoder threads, numbered from the first page of the run
+                    for image_file, file_size, thumbnail_size, extra_size, encode_ms in encoder.map(
+                            encode_page, range(run_start, run_end + 1), images):
+                        # Queue the ProcessedFile row and write it out with the rest of the batch
+                        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        rows.append((image_file, file_name, 'Processing', now, now, file_size, thumbnail_size, extra_size, encode_ms))
+                        if db_batch_size and len(rows) >= db_batch_size:
+                            insert_processed_files(cursor, conn, rows, date_folder)
+                            rows = []
+                    page_count += len(images)
+                    del images
+            except Exception:
+                # Checkpoint the pages already saved, then put the rest of the claim back as failed
+                conn.rollback()
+                try:
+                    insert_processed_files(cursor, conn, rows, date_folder)
+                except Exception:
+                    conn.rollback()
+                page_jobs.mark_failed(conn, file_name, date_folder, claimed + [page_jobs.page_number(row[0]) for row in rows])
+                raise
+
+    insert_processed_files(cursor, conn, rows, date_folder)
+    return page_count
+
+
+def convert_pdf_to_images(input_file, output_folder, cache_key=None, profile_name=None):
+    # Returns the number of pages rendered so callers can report throughput
+    file_name = os.path.basename(input_file)
+    date_folder = get_date_folder(input_file)
+    conn = None
     try:
         # Connect to SQLite database
-        conn = sqlite3.connect('conversion.db')
+        conn = database.get_connection()
         cursor = conn.cursor()
 
-        # Create table if not exists
-        cursor.execute('''CREATE TABLE IF NOT EXISTS ProcessedFile 
-                          (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                          local_file TEXT, 
-                          source_file TEXT, 
-                          status TEXT, 
-                          image_created_datetime TEXT,
-                          updated_datetime TEXT)''')
-        conn.commit()
+        # Reject files pdfinfo cannot read before copying or rendering anything
+        page_count, scan_status = prescan_file(conn, input_file)
+        if page_count is None:
+            update_source_file_status(cursor, file_name, 'Failed')
+            conn.commit()
+            return 0
 
         # Update database with processing status and start datetime
-        start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        file_name = os.path.basename(input_file)
-        cursor.execute('''SELECT * FROM SourceFile WHERE source_file=?''', (file_name,))
-        row = cursor.fetchone()
-        if row:
-            cursor.execute('''UPDATE SourceFile 
-                              SET status=?, updated_datetime=? 
-                              WHERE source_file=?''', 
-                           ('processing', start_datetime, file_name))
-        else:
-            cursor.execute('''INSERT INTO SourceFile (source_file, status, updated_datetime) 
-                              VALUES (?, ?, ?)''', (file_name, 'processing', start_datetime))
+        update_source_file_status(cursor, file_name, 'processing')
         conn.commit()
 
-        # Create folder for the input file
-        today_date = datetime.now().strftime("%y%m%d")
-        file_name_no_extension = os.path.splitext(file_name)[0]
-        file_folder = os.path.join(output_folder, today_date, file_name_no_extension)
-        os.makedirs(file_folder, exist_ok=True)  # Create folder for original PDF file
-        os.makedirs(os.path.join(file_folder, "converted"), exist_ok=True)  # Create folder for converted images
-
-        # Create original folder and copy the original WAV file
-        original_folder = os.path.join(file_folder, "original")
-        os.makedirs(original_folder, exist_ok=True)
-        original_file_destination = os.path.join(original_folder, file_name)
-        shutil.copy(input_file, original_file_destination)
-
-        # Check if images already exist
-        existing_images = [f for f in os.listdir(os.path.join(file_folder, "converted")) if f.startswith(file_name_no_extension) and f.endswith('.jpg')]
-        if existing_images:
-            logging.info(f"Skipping conversion for '{file_name}', images already exist.")
+        file_folder = prepare_file_folder(input_file, output_folder)
+        converted_folder = os.path.join(file_folder, "converted")
+
+        # Check if every page was already converted by an earlier run
+        if page_jobs.is_complete(conn, file_name, date_folder, page_count, converted_folder):
+            logging.info(f"Skipping conversion for '{file_name}', all {page_count} pages already exist.")
             # Update status of the source file to 'Completed'
-            end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute('''UPDATE SourceFile 
-                              SET status=?, updated_datetime=? 
-                              WHERE source_file=?''', 
-                           ('Completed', end_datetime, file_name))
+            update_source_file_status(cursor, file_name, 'Completed')
             conn.commit()
-            conn.close()
-            return
+            pack_pages(file_name, file_folder)
+            return 0
 
-        # Convert PDF to images using pdf2image
-        logging.info(f"Converting '{file_name}' to images.")
-        images = convert_from_path(input_file, dpi=300, fmt='jpeg')
-
-        # Save each page as a separate image
-        for i, image in enumerate(images):
-            image_path = os.path.join(file_folder, "converted", f"{file_name_no_extension}_{i + 1}.jpg")
-            image.save(image_path, "JPEG")
-
-            # Update ProcessedFile table
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute('''INSERT INTO ProcessedFile 
-                              (local_file, source_file, status, image_created_datetime, updated_datetime) 
-                              VALUES (?, ?, ?, ?, ?)''', 
-                           (os.path.basename(image_path), file_name, 'Processing', now, now))
-            conn.commit()
+        # Pick the render profile for this file and record it
+        profile_name = profile_name or render_profiles.select_profile(input_file, page_count)
+        settings = render_profiles.get_profile(profile_name)
+        record_render_profile(cursor, file_name, profile_name)
+        conn.commit()
+
+        # Reuse the pages of an identical PDF rendered earlier with the same parameters
+        cache_key = cache_key or get_cache_key(input_file, settings)
+        if cache_key:
+            restored_count = restore_from_cache(conn, cache_key, file_name, file_folder, settings)
+            if restored_count is not None:
+                update_source_file_status(cursor, file_name, 'Completed')
+                conn.commit()
+                pack_pages(file_name, file_folder)
+                return restored_count
+
+        # Queue a job per page, re-queueing whatever an interrupted run left unfinished
+        page_jobs.create_jobs(conn, file_name, date_folder, page_count)
+        page_jobs.reconcile(conn, file_name, date_folder, converted_folder)
+
+        logging.info(f"Converting '{file_name}' to images with the '{profile_name}' profile.", extra={'file': file_name, 'stage': 'convert'})
+        reset_peak_rss()
+        with metrics.timed('convert', file_name) as sample:
+            rendered = render_pages(input_file, file_folder, cursor, conn, settings, last_page=page_count)
+            sample['pages'] = rendered
+        logging.info(f"Converted '{file_name}' ({rendered} of {page_count} pages rendered), peak RSS {get_peak_rss_mb():.1f} MB.",
+                     extra={'file': file_name, 'stage': 'convert'})
+        if not page_jobs.is_complete(conn, file_name, date_folder, page_count, converted_folder):
+            if page_jobs.get_live_claims(conn, file_name, date_folder):
+                # The process rendering the rest completes the file when it finishes
+                logging.info(f"Leaving '{file_name}' in processing, another process is still rendering some of its pages.")
+                return rendered
+            raise ValueError(f"Pages of '{file_name}' are missing after conversion")
+        page_count = rendered
+        if cache_key:
+            store_in_cache(conn, cache_key, file_name, file_folder)
 
         # Update status of the source file to 'Completed'
-        end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('''UPDATE SourceFile 
-                          SET status=?, updated_datetime=? 
-                          WHERE source_file=?''', 
-                       ('Completed', end_datetime, file_name))
+        update_source_file_status(cursor, file_name, 'Completed')
         conn.commit()
-        conn.close()
-        
+        pack_pages(file_name, file_folder)
+        return page_count
+
     except Exception as e:
-        logging.error(f"Error processing file {input_file}: {str(e)}")
-        end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('''UPDATE SourceFile 
-                          SET status=?, updated_datetime=? 
-                          WHERE source_file=?''', 
-                       ('Failed', end_datetime, file_name))
-        conn.commit()
+        logging.error(f"Error processing file {input_file}: {str(e)}", extra={'file': file_name, 'stage': 'convert'})
+        if conn is not None:
+            conn.rollback()
+            update_source_file_status(conn.cursor(), file_name, 'Failed')
+            conn.commit()
+        move_to_failed(file_name, date_folder)
+        return 0
+    finally:
+        metrics.flush()
+
+
+def convert_page_range(input_file, file_folder, settings, first_page, last_page):
+    # Worker entry point for one slice of a large PDF; the parent owns the SourceFile status
+    conn = database.get_connection()
+    try:
+        file_name = os.path.basename(input_file)
+        logging.info(f"Converting pages {first_page}-{last_page} of '{file_name}' to images.",
+                     extra={'file': file_name, 'page': first_page, 'stage': 'convert_range'})
+        reset_peak_rss()
+        with metrics.timed('convert_range', file_name, first_page) as sample:
+            page_count = render_pages(input_file, file_folder, conn.cursor(), conn, settings, first_page, last_page)
+            sample['pages'] = page_count
+        logging.info(f"Converted pages {first_page}-{last_page} of '{file_name}', peak RSS {get_peak_rss_mb():.1f} MB.",
+                     extra={'file': file_name, 'page': first_page, 'stage': 'convert_range'})
+        return page_count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        metrics.flush()
+
+
+def get_page_count(input_file):
+    from pdf2image import pdfinfo_from_path
+    try:
+        return int(pdfinfo_from_path(input_file)["Pages"])
+    except Exception as e:
+        logging.error(f"Error reading page count of {input_file}: {str(e)}")
+        return None
+
+
+def prepare_split_file(input_file, page_count, profile_name):
+    # Mark the file as processing once and return its output folder and the page ranges to convert
+    file_name = os.path.basename(input_file)
+    conn = database.get_connection()
+    update_source_file_status(conn.cursor(), file_name, 'processing')
+    record_render_profile(conn.cursor(), file_name, profile_name)
+    conn.commit()
+    file_folder = prepare_file_folder(input_file, processing_folder)
+    date_folder = get_date_folder(input_file)
+    page_jobs.create_jobs(conn, file_name, date_folder, page_count)
+    page_jobs.reconcile(conn, file_name, date_folder, os.path.join(file_folder, "converted"))
+
+    ranges = []
+    for first_page in range(1, page_count + 1, pages_per_range):
+        ranges.append((first_page, min(first_page + pages_per_range - 1, page_count)))
+    return file_folder, ranges
+
+
+def finish_split_file(file_name, failed, cache_key=None, file_folder=None, page_count=None):
+    # Only the parent writes the final status of a split file, after all of its ranges finished,
+    # and only marks it completed when every page is on disk
+    conn = database.get_connection()
+    date_folder = os.path.basename(os.path.dirname(file_folder)) if file_folder else None
+    if not failed and not page_jobs.is_complete(conn, file_name, date_folder, page_count, os.path.join(file_folder, "converted")):
+        if page_jobs.get_live_claims(conn, file_name, date_folder):
+            logging.info(f"Leaving '{file_name}' in processing, another process is still rendering some of its pages.")
+            return
+        logging.error(f"Pages of '{file_name}' are missing after conversion")
+        failed = True
+    update_source_file_status(conn.cursor(), file_name, 'Failed' if failed else 'Completed')
+    conn.commit()
+    if failed:
+        move_to_failed(file_name, date_folder)
+        return
+    if cache_key:
+        store_in_cache(conn, cache_key, file_name, file_folder)
+    pack_pages(file_name, file_folder)
+
+
+def get_worker_settings():
+    return {
+        'render_chunk_size': render_chunk_size,
+        'db_batch_size': db_batch_size,
+        'cache_max_bytes': render_cache.cache_max_bytes,
+        'profiles': render_profiles.profiles,
+        'rules': render_profiles.rules,
+        'default_profile': render_profiles.default_profile,
+        'original_placement': original_placement,
+        'placement_mode': placement.placement_mode,
+        'page_storage': page_storage,
+    }
+
+
+def init_worker(settings):
+    # Carry settings parsed in the parent into each pool process
+    global render_chunk_size, db_batch_size, original_placement, page_storage
+    logging_setup.setup_logging()
+    render_chunk_size = settings['render_chunk_size']
+    db_batch_size = settings['db_batch_size']
+    render_cache.cache_max_bytes = settings['cache_max_bytes']
+    render_profiles.profiles = settings['profiles']
+    render_profiles.rules = settings['rules']
+    render_profiles.default_profile = settings['default_profile']
+    original_placement = settings['original_placement']
+    placement.placement_mode = settings['placement_mode']
+    page_storage = settings['page_storage']
+
+
+def get_page_size(conn, file_name):
+    row = conn.execute('''SELECT page_size FROM SourceFile WHERE source_file=? ORDER BY id DESC LIMIT 1''', (file_name,)).fetchone()
+    return row[0] if row else None
+
 
+def fail_file(input_file):
+    # Record a whole file whose job never ran or whose worker died; convert_pdf_to_images records
+    # every other failure itself, but a worker that exits mid-file leaves it in 'processing'
+    file_name = os.path.basename(input_file)
+    conn = database.get_connection()
+    update_source_file_status(conn.cursor(), file_name, 'Failed')
+    conn.commit()
+    move_to_failed(file_name, get_date_folder(input_file))
+
+
+def process_pdf_files_parallel(pdf_files, workers, page_counts=None):
+    total_pages = 0
+    split_files = {}  # file name -> pending range count, failed flag, cache key, output folder and page count
+    input_files = {os.path.basename(input_file): input_file for input_file in pdf_files}
+    initargs = (get_worker_settings(),)
+
+    # Files and page ranges wait here, in schedule order, until the governor admits them; a file's
+    # jobs are only built once everything queued ahead of it has been admitted
+    budget = governor.start(workers)
+    queued = deque()
+
+    def start_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs)
+
+    def finish_job(job, future):
+        # Count a finished job's pages and settle its file once nothing of it is left to run.
+        # Returns False when the job's worker died and took the pool down with it.
+        nonlocal total_pages
+        governor.release(budget, job)
+        file_name = job['name']
+        pool_alive = True
         try:
-            error_file_folder = os.path.join(processing_folder, today_date, file_name_no_extension)
-            failed_folder = os.path.join(os.getcwd(), "failed")
-            if not os.path.exists(failed_folder):
-                os.makedirs(failed_folder)
-            if os.path.exists(error_file_folder):
-                shutil.move(error_file_folder, failed_folder)
-                logging.info(f"Error file '{file_name}' moved to 'failed' folder.")
+            total_pages += future.result()
         except Exception as e:
-            logging.error(f"Error moving error file to 'Failed' folder: {str(e)}")
+            pool_alive = not isinstance(e, BrokenProcessPool)
+            if job['split']:
+                logging.error(f"Error converting pages {job['pages'][0]}-{job['pages'][1]} of '{file_name}': {str(e)}")
+                split_files[file_name]['failed'] = True
+            else:
+                logging.error(f"Error converting '{file_name}': {str(e)}")
+                fail_file(input_files[file_name])
+
+        if job['split']:
+            split_file = split_files[file_name]
+            split_file['pending'] -= 1
+            if split_file['pending'] == 0:
+                finish_split_file(file_name, split_file['failed'], split_file['cache_key'], split_file['file_folder'],
+                                  split_file['page_count'])
+        return pool_alive
+
+    def queue_file(input_file):
+        # Hash, pick a profile and, for a large file, set up its page ranges only once the file reaches
+        # the front of the schedule, so files further back are neither hashed nor marked processing
+        file_name = os.path.basename(input_file)
+        page_count = page_counts[input_file] if page_counts else get_page_count(input_file)
+        profile_name = render_profiles.select_profile(input_file, page_count)
+        settings = render_profiles.get_profile(profile_name)
+        cache_key = get_cache_key(input_file, settings)
+        page_size = get_page_size(database.get_connection(), file_name)
+        cpu = governor.estimate_job_cpu(settings)
+
+        # Cached files are linked into place by a single worker, so there is no point splitting them
+        cached = cache_key is not None and render_cache.lookup(database.get_connection(), cache_key) is not None
+        if page_count and page_count > split_page_threshold and not cached:
+            logging.info(f"Splitting '{file_name}' ({page_count} pages) into ranges of {pages_per_range} pages.")
+            try:
+                if cache_key:
+                    render_cache.record_cache_result(database.get_connection(), file_name, False)
+                file_folder, ranges = prepare_split_file(input_file, page_count, profile_name)
+            except Exception as e:
+                logging.error(f"Error processing file {input_file}: {str(e)}")
+                finish_split_file(file_name, failed=True)
+                return
+            jobs = []
+            for first_page, last_page in ranges:
+                estimate_mb = governor.estimate_job_mb(last_page - first_page + 1, page_size, settings, render_chunk_size)
+                call = (convert_page_range, input_file, file_folder, settings, first_page, last_page)
+                jobs.append(governor.new_job(file_name, call, estimate_mb, cpu, split=True, pages=(first_page, last_page)))
+            split_files[file_name] = {'pending': len(jobs), 'failed': False, 'cache_key': cache_key,
+                                      'file_folder': file_folder, 'page_count': page_count}
+            queued.extend(jobs)
+        else:
+            # A cache hit only links files, so it costs a worker and no rendering memory
+            estimate_mb = governor.worker_base_mb if cached else \
+                governor.estimate_job_mb(page_count, page_size, settings, render_chunk_size)
+            call = (convert_pdf_to_images, input_file, processing_folder, cache_key, profile_name)
+            queued.append(governor.new_job(file_name, call, estimate_mb, cpu))
+
+    files = deque(pdf_files)
+    executor = start_pool()
+    try:
+        running = {}
+        while files or queued or running:
+            pool_alive = True
+            while True:
+                if not queued and files:
+                    input_file = files.popleft()
+                    try:
+                        queue_file(input_file)
+                    except Exception as e:
+                        # Nothing of the file was queued (an unknown profile, an unreadable file, ...); only it fails
+                        logging.error(f"Error processing file {input_file}: {str(e)}")
+                        fail_file(input_file)
+                    continue
+                if not queued or not governor.admit(budget, queued[0]):
+                    break
+                job = queued.popleft()
+                try:
+                    running[executor.submit(*job['call'])] = job
+                except BrokenProcessPool:
+                    # The pool broke since the last wait; the job goes back to the front of the queue
+                    governor.release(budget, job)
+                    queued.appendleft(job)
+                    pool_alive = False
+                    break
+
+            # Wake on the first finished job, or after poll_interval to re-check memory pressure
+            done, _ = wait(running, timeout=governor.poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                pool_alive = finish_job(running.pop(future), future) and pool_alive
+
+            if not pool_alive:
+                # A worker exited abruptly (killed, out of memory or crashed in poppler) and every job
+                # still running failed with it. Settle those, then go on with the queued jobs on a new pool.
+                for future in list(running):
+                    future.exception()
+                    finish_job(running.pop(future), future)
+                executor.shutdown()
+                logging.error(f"A conversion worker exited abruptly; restarting the pool for {len(queued)} queued job(s) "
+                              f"and {len(files)} file(s) not queued yet.")
+                executor = start_pool()
+    finally:
+        executor.shutdown()
+
+    return total_pages
 
 
-def process_pdf_files():
+def process_pdf_files(workers=1, order=None):
     try:
         today_date = datetime.now().strftime("%y%m%d")
         input_folder_today = os.path.join(input_folder, today_date)
         if not os.path.exists(input_folder_today):
             logging.info(f"No files found for today's date {today_date} in the input folder.")
             return
-        
-        files = os.listdir(input_folder_today)
 
-        for file in files:
-            if file.endswith(".pdf"):
-                convert_pdf_to_images(os.path.join(input_folder_today, file), processing_folder)
+        pdf_files = [os.path.join(input_folder_today, file) for file in os.listdir(input_folder_today) if file.endswith(".pdf")]
+
+        # Read every file's page count up front, drop the unreadable ones and order the rest
+        pdf_files, page_counts = schedule_files(pdf_files, order)
+
+        start_time = time.monotonic()
+        run_started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if workers > 1:
+            total_pages = process_pdf_files_parallel(pdf_files, workers, page_counts)
+        else:
+            total_pages = 0
+            for input_file in pdf_files:
+                total_pages += convert_pdf_to_images(input_file, processing_folder)
+        elapsed = time.monotonic() - start_time
+
+        # Report throughput for the whole run
+        if pdf_files and elapsed > 0:
+            logging.info(f"Converted {len(pdf_files)} files ({total_pages} pages) with {workers} worker(s) in {elapsed:.1f}s: "
+                         f"{len(pdf_files) / elapsed:.2f} files/sec, {total_pages / elapsed:.2f} pages/sec.")
+            placement.log_placement_totals(run_started)
     except Exception as e:
         logging.error(f"Error processing PDF files: {str(e)}")
+    finally:
+        metrics.write_textfile()
+        database.close_connection()
+
+
+def main():
+    global render_chunk_size, db_batch_size, original_placement, page_storage
+    parser = argparse.ArgumentParser(description="Convert today's input PDFs to images.")
+    parser.add_argument("--workers", type=int, default=default_workers, help="Number of conversion processes (1 disables the pool).")
+    parser.add_argument("--chunk-size", type=int, default=render_chunk_size, help="Pages rendered and held in memory at a time.")
+    parser.add_argument("--profile", help="Render every file with this profile, ignoring the profile rules.")
+    parser.add_argument("--profiles-file", default=render_profiles.profiles_file, help="JSON file with render profiles and rules.")
+    parser.add_argument("--cache-size-gb", type=float, default=render_cache.cache_max_bytes / 1024 ** 3, help="Render cache size cap (0 disables the cache).")
+    parser.add_argument("--db-batch-size", type=int, default=db_batch_size, help="ProcessedFile rows per transaction (0 = one per file).")
+    parser.add_argument("--order", choices=['sjf', 'lpt', 'listing'], default=schedule_order, help="Conversion order after the pre-scan.")
+    parser.add_argument("--placement", choices=['auto', 'hardlink', 'copy'], default=placement.placement_mode,
+                        help="How originals are placed: reflink or hardlink where possible ('auto'), or always copy.")
+    parser.add_argument("--defer-original", action="store_true",
+                        help="Render from the downloaded file and move it into original/ only when the file completes.")
+    parser.add_argument("--memory-budget-mb", type=float, default=governor.memory_budget_mb,
+                        help="Estimated rendering memory allowed in flight (0 = a share of available memory).")
+    parser.add_argument("--cpu-budget", type=int, default=governor.cpu_budget, help="Cores the running jobs may use (0 = all).")
+    parser.add_argument("--page-storage", choices=['files', 'archive'], default=page_storage,
+                        help="Keep each page as its own file, or pack a completed document's pages into one stored zip.")
+    args = parser.parse_args()
+    page_storage = args.page_storage
+    placement.placement_mode = args.placement
+    governor.memory_budget_mb = max(0, args.memory_budget_mb)
+    governor.cpu_budget = max(0, args.cpu_budget)
+    if args.defer_original:
+        original_placement = 'defer'
+    render_chunk_size = max(1, args.chunk_size)
+    db_batch_size = max(0, args.db_batch_size)
+    render_cache.cache_max_bytes = int(max(0, args.cache_size_gb) * 1024 ** 3)
+    render_profiles.load_profiles(args.profiles_file)
+    if args.profile:
+        render_profiles.get_profile(args.profile)
+        render_profiles.default_profile = args.profile
+        render_profiles.rules = []
+
+    logging_setup.setup_logging()
 
+    # Call the function to process PDF files
+    process_pdf_files(workers=max(1, args.workers), order=args.order)
 
 
-# Call the function to process PDF files
-process_pdf_files()
+if __name__ == "__main__":
+    main()
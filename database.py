@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+db_file = 'conversion.db'
+
+# Seconds a connection waits for another process's write lock before giving up
+db_timeout = 30
+
+# WAL lets readers run alongside the single writer and needs one fsync per checkpoint instead of
+# one per commit. It relies on shared memory, so every process must run on the same host as the DB.
+journal_mode = 'WAL'
+
+# NORMAL is durable across application crashes under WAL; only a power loss can drop the last commits
+synchronous = 'NORMAL'
+
+_local = threading.local()
+
+source_file_table = '''CREATE TABLE IF NOT EXISTS SourceFile
+                       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       source_file TEXT,
+                       local_file TEXT,
+                       file_size INTEGER,
+                       status TEXT,
+                       download_datetime TEXT,
+                       updated_datetime TEXT)'''
+
+processed_file_table = '''CREATE TABLE IF NOT EXISTS ProcessedFile
+                          (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          local_file TEXT,
+                          source_file TEXT,
+                          status TEXT,
+                          image_created_datetime TEXT,
+                          updated_datetime TEXT)'''
+
+# Datetimes are stored as 'YYYY-MM-DD HH:MM:SS' text, which sorts chronologically, so plain
+# indexes on the datetime columns serve per-day lookups written as range predicates (see day_range).
+indexes = [
+    '''CREATE INDEX IF NOT EXISTS idx_sourcefile_source_file ON SourceFile (source_file, download_datetime)''',
+    '''CREATE INDEX IF NOT EXISTS idx_sourcefile_updated ON SourceFile (updated_datetime)''',
+    '''CREATE INDEX IF NOT EXISTS idx_sourcefile_status_updated ON SourceFile (status, updated_datetime)''',
+    '''CREATE INDEX IF NOT EXISTS idx_processedfile_source_file ON ProcessedFile (source_file)''',
+    '''CREATE INDEX IF NOT EXISTS idx_processedfile_status_created ON ProcessedFile (status, image_created_datetime)''',
+]
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records how far a DB has got.
+# Append new steps rather than editing old ones so existing conversion.db files upgrade in place.
+migrations = [
+    [source_file_table, processed_file_table],
+    indexes,
+    ['''ALTER TABLE SourceFile ADD COLUMN content_hash TEXT'''],
+    ['''CREATE TABLE IF NOT EXISTS RenderCache
+        (cache_key TEXT PRIMARY KEY,
+        source_file TEXT,
+        page_count INTEGER,
+        size_bytes INTEGER,
+        hits INTEGER,
+        created_datetime TEXT,
+        last_used_datetime TEXT)''',
+     '''CREATE INDEX IF NOT EXISTS idx_rendercache_last_used ON RenderCache (last_used_datetime)''',
+     '''ALTER TABLE SourceFile ADD COLUMN cache_status TEXT'''],
+    ['''ALTER TABLE SourceFile ADD COLUMN render_profile TEXT'''],
+    ['''CREATE TABLE IF NOT EXISTS Metrics
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stage TEXT,
+        source_file TEXT,
+        page INTEGER,
+        duration_ms REAL,
+        bytes INTEGER,
+        pages INTEGER,
+        recorded_datetime TEXT)''',
+     '''CREATE INDEX IF NOT EXISTS idx_metrics_recorded ON Metrics (recorded_datetime, stage)'''],
+    ['''CREATE TABLE IF NOT EXISTS ReportWatermark
+        (report_name TEXT PRIMARY KEY,
+        last_updated_datetime TEXT,
+        report_datetime TEXT)''',
+     # Covers the grouped per-day status count without touching the table
+     '''CREATE INDEX IF NOT EXISTS idx_sourcefile_updated_status ON SourceFile (updated_datetime, status)''',
+     '''DROP INDEX IF EXISTS idx_sourcefile_updated'''],
+    # Covers the retention sweep's lookup of source files rendered within a range of days
+    ['''CREATE INDEX IF NOT EXISTS idx_processedfile_created ON ProcessedFile (image_created_datetime, source_file)'''],
+    # One row per page of a download (the file name plus the <yymmdd> folder its pages go to),
+    # pointing at the ProcessedFile row written for the page
+    ['''CREATE TABLE IF NOT EXISTS PageJob
+        (source_file TEXT,
+        date_folder TEXT,
+        page INTEGER,
+        status TEXT,
+        worker_pid INTEGER,
+        attempts INTEGER,
+        local_file TEXT,
+        processed_file_id INTEGER,
+        updated_datetime TEXT,
+        PRIMARY KEY (source_file, date_folder, page))'''],
+    ['''ALTER TABLE ProcessedFile ADD COLUMN file_size INTEGER''',
+     '''ALTER TABLE ProcessedFile ADD COLUMN thumbnail_size INTEGER''',
+     '''ALTER TABLE ProcessedFile ADD COLUMN extra_size INTEGER''',
+     '''ALTER TABLE ProcessedFile ADD COLUMN encode_ms REAL'''],
+    ['''ALTER TABLE SourceFile ADD COLUMN page_count INTEGER''',
+     '''ALTER TABLE SourceFile ADD COLUMN page_size TEXT''',
+     '''ALTER TABLE SourceFile ADD COLUMN encrypted INTEGER''',
+     '''ALTER TABLE SourceFile ADD COLUMN scan_status TEXT'''],
+    # Retry bookkeeping for the catch-up run, which works through outstanding files oldest first
+    ['''ALTER TABLE SourceFile ADD COLUMN attempts INTEGER''',
+     '''ALTER TABLE SourceFile ADD COLUMN next_attempt_datetime TEXT''',
+     '''CREATE INDEX IF NOT EXISTS idx_sourcefile_status_downloaded ON SourceFile (status, download_datetime)'''],
+    # Lets the pre-scan reuse the scan of any file with the same content
+    ['''CREATE INDEX IF NOT EXISTS idx_sourcefile_content_hash ON SourceFile (content_hash)'''],
+]
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or db_file, timeout=db_timeout)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    return conn
+
+
+def ensure_schema(conn):
+    # Create both tables and bring an existing database up to the latest schema version
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(migrations):
+        return
+
+    # Take the write lock before re-reading the version so concurrent processes upgrade only once
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version in range(current_version, len(migrations)):
+            for statement in migrations[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version={version + 1}")
+            logging.info(f"Upgraded database schema to version {version + 1}.")
+        conn.commit()
+    except Exception:
+        # Release the write lock and keep the database at its old version rather than half upgraded
+        conn.rollback()
+        raise
+    if current_version < len(migrations):
+        # Refresh planner statistics so the new indexes are picked up straight away
+        conn.execute("ANALYZE")
+        conn.commit()
+
+
+def get_connection():
+    # One connection per process and thread, opened on first use and reused for the rest of the run.
+    # A forked worker gets a fresh connection rather than sharing its parent's.
+    if getattr(_local, 'connection', None) is None or _local.pid != os.getpid():
+        _local.connection = connect()
+        _local.pid = os.getpid()
+        ensure_schema(_local.connection)
+    return _local.connection
+
+
+def close_connection():
+    if getattr(_local, 'connection', None) is not None and _local.pid == os.getpid():
+        _local.connection.close()
+    _local.connection = None
+
+
+def day_range(date):
+    # Turn a 'YYYY-MM-DD' date into [start, end) bounds an index on a datetime column can seek to
+    start = datetime.strptime(str(date), "%Y-%m-%d")
+    end = start + timedelta(days=1)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main():
+    # Upgrade conversion.db in place
+    conn = connect()
+    ensure_schema(conn)
+    print(f"{db_file} is at schema version {conn.execute('PRAGMA user_version').fetchone()[0]}.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
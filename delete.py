@@ -1,73 +1,206 @@
 import os
 import shutil
-import sqlite3
+import argparse
 from datetime import datetime, timedelta
 import logging
+import database
+import logging_setup
+import metrics
 
-def move_processed_folders_to_deleted():
-    try:
-        # Constants
-        completed_folder = "completed/"
-        deleted_folder = "deleted/"
+# Constants
+completed_folder = "completed/"
+deleted_folder = "deleted/"
+
+# Days a date folder stays in completed/ before it is moved to deleted/
+completed_retention_days = 1
+
+# Days a date folder stays in deleted/ before it is removed for good (0 keeps deleted/ forever)
+deleted_retention_days = 0
+
+
+def get_expired_date_folders(parent_folder, retention_days, today=None):
+    # Date folders (<yymmdd>) under parent_folder that are at least retention_days old, oldest first.
+    # Listing the parent touches one entry per day, however many pages each folder holds.
+    today = today or datetime.now().date()
+    threshold_date = today - timedelta(days=retention_days)
+    if not os.path.isdir(parent_folder):
+        return []
+    expired = []
+    for entry in os.scandir(parent_folder):
+        if not entry.is_dir():
+            continue
+        try:
+            folder_date = datetime.strptime(entry.name, "%y%m%d").date()
+        except ValueError:
+            continue
+        if folder_date <= threshold_date:
+            expired.append((folder_date, entry.path))
+    return sorted(expired)
+
+
+def get_purgeable_folders(parent_folder, retention_days, now=None):
+    # Date folders under parent_folder moved in at least retention_days ago, oldest first. A folder is
+    # aged by the time it was moved to deleted/ (stamped on the folder at the move), not by its name,
+    # which is the day its files completed.
+    now = now or datetime.now()
+    threshold = (now - timedelta(days=retention_days)).timestamp()
+    if not os.path.isdir(parent_folder):
+        return []
+    expired = []
+    for entry in os.scandir(parent_folder):
+        if not entry.is_dir():
+            continue
+        try:
+            datetime.strptime(entry.name, "%y%m%d")
+            moved_time = entry.stat().st_mtime
+        except (ValueError, OSError):
+            continue
+        if moved_time <= threshold:
+            expired.append((moved_time, entry.path))
+    return sorted(expired)
+
+
+def get_folder_usage(path):
+    # Total bytes and file count under a folder
+    total_bytes = 0
+    total_files = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total_bytes += os.lstat(os.path.join(root, file)).st_size
+                total_files += 1
+            except OSError:
+                pass
+    return total_bytes, total_files
+
+
+def move_folder(source_path, destination_parent):
+    # Move a whole date folder with one rename when both sides share a filesystem. If the
+    # destination already exists (an earlier partial sweep), its entries are merged in instead.
+    destination_path = os.path.join(destination_parent, os.path.basename(source_path.rstrip(os.sep)))
+    if not os.path.exists(destination_path):
+        try:
+            os.rename(source_path, destination_path)
+            return destination_path
+        except OSError:
+            # Different filesystem: fall back to a copying move
+            shutil.move(source_path, destination_path)
+            return destination_path
+    for entry in os.listdir(source_path):
+        move_folder(os.path.join(source_path, entry), destination_path)
+    os.rmdir(source_path)
+    return destination_path
+
+
+def mark_folders_deleted(conn, expired_folders, current_datetime):
+    # Mark every source file completed on the expired days as deleted, in one statement over the
+    # SourceFile status index. completed/ folders are dated by completion, which is when a file's
+    # status became 'Done', whenever its pages were rendered.
+    first_day = expired_folders[0][0]
+    last_day = expired_folders[-1][0]
+    range_start = database.day_range(first_day)[0]
+    range_end = database.day_range(last_day)[1]
+    cursor = conn.execute('''UPDATE SourceFile
+                             SET status=?, updated_datetime=?
+                             WHERE status=?
+                             AND updated_datetime >= ?
+                             AND updated_datetime < ?''',
+                          ('Deleted', current_datetime.strftime("%Y-%m-%d %H:%M:%S"), 'Done', range_start, range_end))
+    conn.commit()
+    return cursor.rowcount
 
-        # Connect to SQLite database
-        conn = sqlite3.connect('conversion.db')
-        cursor = conn.cursor()
+
+def move_processed_folders_to_deleted(retention_days=None, dry_run=False):
+    try:
+        retention_days = completed_retention_days if retention_days is None else retention_days
 
         # Get current date and time
         current_datetime = datetime.now()
 
-        # Calculate the threshold datetime (24 hours ago)
-        threshold_datetime = current_datetime - timedelta(days=1)
-
-        # Get the list of processed folders that are older than 24 hours
-        cursor.execute('''SELECT DISTINCT source_file, DATE(image_created_datetime) 
-                          FROM ProcessedFile 
-                          WHERE DATE(image_created_datetime) <= ? 
-                          AND status = ?''', 
-                       (threshold_datetime.date(), 'Completed'))
-        folders_to_delete = cursor.fetchall()
+        # Get the list of completed date folders older than the retention window
+        expired_folders = get_expired_date_folders(completed_folder, retention_days, current_datetime.date())
 
         # If no folders need to be deleted, exit the function
-        if not folders_to_delete:
+        if not expired_folders:
             logging.info("No folders to delete. Exiting the function.")
             return
 
-        # Path to deleted folder
-        deleted_folder_path = os.path.join(deleted_folder)
+        if dry_run:
+            total_bytes = 0
+            total_files = 0
+            for _, folder_path in expired_folders:
+                folder_bytes, folder_files = get_folder_usage(folder_path)
+                total_bytes += folder_bytes
+                total_files += folder_files
+                logging.info(f"Dry run: would move {folder_path} ({folder_files} files, {folder_bytes} bytes) to deleted folder.")
+            message = (f"Dry run: would move {len(expired_folders)} folders holding {total_files} files "
+                       f"({total_bytes / 1048576:.1f} MB) to deleted folder.")
+            logging.info(message)
+            print(message)
+            return
 
         # Create the deleted folder if it doesn't exist
-        os.makedirs(deleted_folder_path, exist_ok=True)
-        # Move processed folders to deleted folder
-        for source_file, download_datetime in folders_to_delete:
-                # Path to the completed folder
-                date_object = datetime.strptime(download_datetime, '%Y-%m-%d')  
-                completed_folder_path = os.path.join(completed_folder, date_object.strftime("%y%m%d"))  
-                # Move the folder to the deleted folder
-                destination_path = os.path.join(deleted_folder_path)
-                shutil.move(completed_folder_path, destination_path)
-                logging.info(f"Moved folder {completed_folder_path} to deleted folder.")
+        os.makedirs(deleted_folder, exist_ok=True)
+
+        # Move each expired date folder to the deleted folder exactly once
+        for _, folder_path in expired_folders:
+            with metrics.timed('retention', os.path.basename(folder_path)):
+                destination_path = move_folder(folder_path, deleted_folder)
+            # A rename keeps the folder's old modification time; stamp the move so the purge ages it from now
+            os.utime(destination_path)
+            logging.info(f"Moved folder {folder_path} to deleted folder.")
 
         # If all folders are moved successfully, update the status in the SourceFile table to "deleted"
-        cursor.execute('''UPDATE SourceFile 
-                          SET status=?, updated_datetime=? 
-                          WHERE source_file IN (SELECT DISTINCT source_file FROM ProcessedFile 
-                                                WHERE DATE(image_created_datetime) <= ? 
-                                                AND status = ?)''', 
-                       ('Deleted', current_datetime.strftime("%Y-%m-%d %H:%M:%S"), threshold_datetime.date(), 'Completed'))
-        conn.commit()
-        logging.info("Updated status in SourceFile table to 'Deleted'.")
+        conn = database.get_connection()
+        updated = mark_folders_deleted(conn, expired_folders, current_datetime)
+        logging.info(f"Updated status of {updated} source files in SourceFile table to 'Deleted'.")
 
         # Close the database connection
-        conn.close()
+        metrics.write_textfile()
+        database.close_connection()
         logging.info("Processed folders moved to deleted folder successfully.")
     except Exception as e:
         logging.error(f"Error moving processed folders to deleted folder: {str(e)}")
 
-# Set up logging
-log_file = 'logs/pdf_convert.log'
-os.makedirs(os.path.dirname(log_file), exist_ok=True)
-logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Call the function to move processed folders to the deleted folder
-move_processed_folders_to_deleted()
+def purge_deleted_folders(retention_days=None, dry_run=False):
+    # Permanently remove date folders that have sat in deleted/ past their retention window
+    try:
+        retention_days = deleted_retention_days if retention_days is None else retention_days
+        if retention_days <= 0:
+            return
+        expired_folders = get_purgeable_folders(deleted_folder, retention_days)
+        total_bytes = 0
+        total_files = 0
+        for _, folder_path in expired_folders:
+            folder_bytes, folder_files = get_folder_usage(folder_path)
+            total_bytes += folder_bytes
+            total_files += folder_files
+            if not dry_run:
+                with metrics.timed('purge', os.path.basename(folder_path)) as sample:
+                    shutil.rmtree(folder_path)
+                    sample['bytes'] = folder_bytes
+        prefix = "Dry run: would reclaim" if dry_run else "Reclaimed"
+        message = f"{prefix} {total_bytes / 1048576:.1f} MB in {total_files} files from {len(expired_folders)} deleted folders."
+        logging.info(message)
+        if dry_run:
+            print(message)
+    except Exception as e:
+        logging.error(f"Error purging deleted folders: {str(e)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move expired completed folders to deleted/ and purge old deleted folders.")
+    parser.add_argument("--completed-days", type=int, default=completed_retention_days, help="Days to keep folders in completed/.")
+    parser.add_argument("--deleted-days", type=int, default=deleted_retention_days, help="Days to keep folders in deleted/ (0 keeps them).")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many files and bytes would be moved or reclaimed.")
+    args = parser.parse_args()
+    logging_setup.setup_logging()
+
+    # Call the function to move processed folders to the deleted folder
+    move_processed_folders_to_deleted(args.completed_days, args.dry_run)
+    purge_deleted_folders(args.deleted_days, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
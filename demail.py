@@ -1,32 +1,49 @@
 import os
-import sqlite3
-import pandas as pd
+import database
+import logging_setup
+import report
 from datetime import datetime, timedelta
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-import ssl
 import logging
 import base64
+import gzip
+import json
+
+# SMTP server; set SMTP_SSL=0 for a plain connection, e.g. to a local aiosmtpd stand-in
+smtp_host = os.environ.get('SMTP_HOST', "smtp.gmail.com")
+smtp_port = int(os.environ.get('SMTP_PORT', 465))
+smtp_ssl = os.environ.get('SMTP_SSL', '1') != '0'
+
+# Attachments larger than this with a text extension are gzipped before sending
+compress_threshold = 1024 * 1024
+compressible_extensions = ('.log', '.csv', '.txt')
+
+# Total attachment bytes per message; base64 adds a third, so this stays under Gmail's 25 MB limit
+attachment_budget_bytes = 18 * 1024 * 1024
+
+# The daily mail carries the log written since the previous one, capped at its last log_tail_max_bytes
+log_tail_max_bytes = 64 * 1024 * 1024
+log_offset_file = "reports/.log_offset.json"
 
 def get_file_count(db_file, table, status_column=None, status=None, date_column=None, date=None):
     try:
         # Connect to SQLite database
-        conn = sqlite3.connect(db_file)
+        conn = database.connect(db_file)
         cursor = conn.cursor()
 
-        # Query to get file count based on status and/or date
+        # Query to get file count based on status and/or date; dates are matched as a range so the index applies
         if status_column and status and date_column and date:
-            query = f"SELECT COUNT(*) FROM {table} WHERE {status_column} = ? AND substr({date_column}, 1, 10) = ?"
-            cursor.execute(query, (status, date))
+            query = f"SELECT COUNT(*) FROM {table} WHERE {status_column} = ? AND {date_column} >= ? AND {date_column} < ?"
+            cursor.execute(query, (status, *database.day_range(date)))
         elif status_column and status:
             query = f"SELECT COUNT(*) FROM {table} WHERE {status_column} = ?"
             cursor.execute(query, (status,))
         elif date_column and date:
-            query = f"SELECT COUNT(*) FROM {table} WHERE substr({date_column}, 1, 10) = ?"
-            cursor.execute(query, (date,))
+            query = f"SELECT COUNT(*) FROM {table} WHERE {date_column} >= ? AND {date_column} < ?"
+            cursor.execute(query, database.day_range(date))
         else:
             query = f"SELECT COUNT(*) FROM {table}"
             cursor.execute(query)
@@ -41,8 +58,94 @@ def get_file_count(db_file, table, status_column=None, status=None, date_column=
         logging.error(f"Error getting file count: {str(e)}")
         return None
 
-def send_email(sender_email, receiver_email, cc_emails, password, subject, body, attachment_paths=None):
+def decode_variable(encoded_variable):
+    # Function to decode Base64 encoded variables
+    return base64.b64decode(encoded_variable.encode()).decode()
+
+def open_smtp(sender_email=None, password=None):
+    # One logged-in SMTP connection; reuse it for every message of a run. The credentials default to
+    # EMAIL_SENDER and EMAIL_PASSWORD. Without a password the login is skipped, which lets a local
+    # stand-in such as aiosmtpd (SMTP_HOST=localhost SMTP_PORT=8025 SMTP_SSL=0) receive the mail.
+    import ssl
+    import smtplib
+    if password is None:
+        password = decode_variable(os.environ.get('EMAIL_PASSWORD', ''))
+    if smtp_ssl:
+        server = smtplib.SMTP_SSL(smtp_host, smtp_port, context=ssl.create_default_context())
+    else:
+        server = smtplib.SMTP(smtp_host, smtp_port)
+    if password:
+        server.login(sender_email or decode_variable(os.environ.get('EMAIL_SENDER')), password)
+    return server
+
+def read_log_offset(log_path):
+    # Where the last report's log tail ended, or 0 when the log has been replaced or truncated since
     try:
+        with open(log_offset_file) as f:
+            state = json.load(f)
+        stat = os.stat(log_path)
+        if state['inode'] == stat.st_ino and state['offset'] <= stat.st_size:
+            return state['offset']
+    except (OSError, ValueError, KeyError):
+        pass
+    return 0
+
+def write_log_offset(log_path, offset):
+    os.makedirs(os.path.dirname(log_offset_file), exist_ok=True)
+    with open(log_offset_file, 'w') as f:
+        json.dump({'inode': os.stat(log_path).st_ino, 'offset': offset}, f)
+
+def gzip_file(source_path, destination_path, start=0, end=None):
+    # Stream bytes [start, end) of a file into a gzip file without reading it into memory
+    with open(source_path, 'rb') as source, gzip.open(destination_path, 'wb') as destination:
+        source.seek(start)
+        remaining = (end if end is not None else os.path.getsize(source_path)) - start
+        while remaining > 0:
+            block = source.read(min(1024 * 1024, remaining))
+            if not block:
+                break
+            destination.write(block)
+            remaining -= len(block)
+    return destination_path
+
+def prepare_log_tail(log_path, report_date):
+    # Gzip only the part of the log written since the last report, at most log_tail_max_bytes of it.
+    # Returns the attachment path and the offset to record once the mail has gone out.
+    end = os.path.getsize(log_path)
+    start = max(read_log_offset(log_path), end - log_tail_max_bytes)
+    tail_path = os.path.join(report.reports_folder, f"pdf_convert_{report_date}.log.gz")
+    os.makedirs(report.reports_folder, exist_ok=True)
+    return gzip_file(log_path, tail_path, start, end), end
+
+def prepare_attachments(attachment_paths):
+    # Compress large text attachments and keep the rest within the size budget, in the order given.
+    # Returns the files to attach and a note listing anything left out.
+    attachments = []
+    omitted = []
+    total_bytes = 0
+    for attachment_path in attachment_paths:
+        if not os.path.isfile(attachment_path):
+            omitted.append(f"{attachment_path} (missing)")
+            continue
+        if attachment_path.endswith(compressible_extensions) and os.path.getsize(attachment_path) > compress_threshold:
+            os.makedirs(report.reports_folder, exist_ok=True)
+            attachment_path = gzip_file(attachment_path, os.path.join(report.reports_folder, os.path.basename(attachment_path) + ".gz"))
+        size = os.path.getsize(attachment_path)
+        if total_bytes + size > attachment_budget_bytes:
+            omitted.append(f"{attachment_path} ({size / 1048576:.1f} MB, over the attachment budget)")
+            continue
+        attachments.append(attachment_path)
+        total_bytes += size
+    note = "\n\nNot attached:\n" + "\n".join(omitted) if omitted else ""
+    return attachments, note
+
+def send_email(sender_email, receiver_email, cc_emails, password, subject, body, attachment_paths=None, server=None):
+    # Send one message; receiver_email may list several addresses separated by commas. Pass server
+    # (from open_smtp) to send several messages over one connection; otherwise this call opens its own
+    # with sender_email and password, or the EMAIL_PASSWORD login when password is None.
+    try:
+        attachments, note = prepare_attachments(attachment_paths or [])
+
         # Setup the MIME
         message = MIMEMultipart()
         message['From'] = sender_email
@@ -51,37 +154,41 @@ def send_email(sender_email, receiver_email, cc_emails, password, subject, body,
         message['Subject'] = subject
 
         # Add body to email
-        message.attach(MIMEText(body, 'plain'))
+        message.attach(MIMEText(body + note, 'plain'))
 
-        if attachment_paths:
-            for attachment_path in attachment_paths:
-                # Open file in binary mode
-                with open(attachment_path, 'rb') as attachment:
-                    # Add file as application/octet-stream
-                    # Email client can usually download this automatically as attachment
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment.read())
+        for attachment_path in attachments:
+            # Open file in binary mode; the size budget bounds how much is read
+            with open(attachment_path, 'rb') as attachment:
+                # Add file as application/octet-stream
+                # Email client can usually download this automatically as attachment
+                part = MIMEBase('application', 'octet-stream')
+                part.set_payload(attachment.read())
 
-                # Encode file in ASCII characters to send by email    
-                encoders.encode_base64(part)
+            # Encode file in ASCII characters to send by email    
+            encoders.encode_base64(part)
 
-                # Add header as key/value pair to attachment part
-                part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(attachment_path)}')
+            # Add header as key/value pair to attachment part
+            part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(attachment_path)}')
 
-                # Add attachment to message
-                message.attach(part)
+            # Add attachment to message
+            message.attach(part)
 
-        # Create secure connection with server and send email
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-            server.login(sender_email, password)
-            server.sendmail(sender_email, [receiver_email] + cc_emails, message.as_string())
+        recipients = [email.strip() for email in receiver_email.split(',') if email.strip()] + \
+            [cc.strip() for cc in cc_emails if cc.strip()]
+        if server is not None:
+            server.send_message(message, sender_email, recipients)
+        else:
+            with open_smtp(sender_email, password) as own_server:
+                own_server.send_message(message, sender_email, recipients)
 
-        logging.info("Email sent successfully")
+        logging.info(f"Email '{subject}' sent to {len(recipients)} recipient(s)")
+        return True
     except Exception as e:
         logging.error(f"Error sending email: {str(e)}")
+        return False
 
-def send_daily_status_email():
+def send_daily_status_email(server=None):
+    # Reuses server when given, otherwise opens its own connection
     try:
         # Database file
         db_file = "conversion.db"
@@ -89,40 +196,41 @@ def send_daily_status_email():
         # Get today's date
         today_date = datetime.now().strftime("%Y-%m-%d")
 
-        # Get total file count
-        total_files = get_file_count(db_file, "SourceFile", date_column="updated_datetime", date=today_date)
-
-        # Get counts for processed, failed, and deleted files
-        processed_files = get_file_count(db_file, "SourceFile", status_column="status", status="Done", date_column="updated_datetime", date=today_date)
-        failed_files = get_file_count(db_file, "SourceFile", status_column="status", status="Failed", date_column="updated_datetime", date=today_date)
-        deleted_files = get_file_count(db_file, "SourceFile", status_column="status", status="Deleted", date_column="updated_datetime", date=today_date)
-
-        # Function to decode Base64 encoded variables
-        def decode_variable(encoded_variable):
-            decoded_variable = base64.b64decode(encoded_variable.encode()).decode()
-            return decoded_variable
+        # Get total, processed, failed and deleted file counts from one grouped query
+        conn = database.connect(db_file)
+        status_counts = report.get_status_counts(conn, today_date)
+        conn.close()
+        total_files = sum(status_counts.values())
+        processed_files = status_counts.get("Done", 0)
+        failed_files = status_counts.get("Failed", 0)
+        deleted_files = status_counts.get("Deleted", 0)
 
         # Email content
         sender_email = decode_variable(os.environ.get('EMAIL_SENDER'))
-        receiver_email = decode_variable(os.environ.get('EMAIL_RECEIVER'))
+        receivers = [email.strip() for email in decode_variable(os.environ.get('EMAIL_RECEIVER')).split(',') if email.strip()]
         cc_emails = decode_variable(os.environ.get('EMAIL_CC', '')).split(',') # Split multiple emails by comma
-        password = decode_variable(os.environ.get('EMAIL_PASSWORD'))
         subject = "Daily Status Report"
         body = f"Date: {today_date}\nTotal files: {total_files}\nProcessed files: {processed_files}\nFailed files: {failed_files}\nDeleted files: {deleted_files}"
-        attachment_paths = [
-            f"reports/Report_{today_date}.xlsx",  
-            "logs/pdf_convert.log"  
-        ]
 
-        # Send email
-        send_email(sender_email, receiver_email, cc_emails, password, subject, body, attachment_paths)
+        # Attach the report and the log written since the last report, gzipped
+        attachment_paths = [os.path.join(report.reports_folder, f"Report_{today_date}.xlsx")]
+        log_offset = None
+        if os.path.isfile(logging_setup.log_file):
+            log_tail, log_offset = prepare_log_tail(logging_setup.log_file, today_date)
+            attachment_paths.append(log_tail)
+
+        # One message to every receiver, so each CC address gets a single copy
+        sent = send_email(sender_email, ", ".join(receivers), cc_emails, None, subject, body, attachment_paths, server=server)
+
+        # Only move the log offset on once the tail has actually gone out
+        if log_offset is not None and sent:
+            write_log_offset(logging_setup.log_file, log_offset)
     except Exception as e:
         logging.error(f"Error sending daily status email: {str(e)}")
 
-if __name__ == "__main__":
-    # Set up logging
-    log_file = 'logs/pdf_convert.log'
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
+def main():
+    logging_setup.setup_logging()
     send_daily_status_email()
+
+if __name__ == "__main__":
+    main()
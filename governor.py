@@ -0,0 +1,151 @@
+import os
+import re
+import time
+import logging
+import metrics
+
+# Decides when the conversion pool may start another file or page range. Each job's memory is
+# estimated before it is admitted, and jobs wait in schedule order while the estimates of the jobs
+# already running would push past the budget or while the host reports memory pressure. A job is
+# always admitted when nothing else is running, so one file larger than the budget still converts.
+
+# RSS the running jobs may add up to, in MB; 0 uses memory_budget_share of MemAvailable at the start of the run
+memory_budget_mb = 0
+memory_budget_share = 0.7
+
+# Cores the running jobs may use between them; 0 allows one per CPU
+cpu_budget = 0
+
+# Resident memory of a worker before it renders anything: interpreter, poppler and the DB connection
+worker_base_mb = 80
+
+# Rendered bitmaps held per page: poppler's output plus the encoder's working copy
+image_copies = 2
+
+# Page size assumed when the pre-scan recorded none (US letter, in points)
+default_page_size = (612.0, 792.0)
+
+# No new job starts while the memory PSI 'some avg10' exceeds this percentage, MemAvailable would
+# drop below min_available_mb, or the 1-minute load average per core exceeds max_load_per_core
+psi_memory_limit = 10.0
+min_available_mb = 512
+max_load_per_core = 2.0
+
+# Seconds between admission checks while jobs are waiting
+poll_interval = 1.0
+
+page_size_pattern = re.compile(r'([\d.]+) x ([\d.]+) pts')
+
+
+def parse_page_size(page_size):
+    # pdfinfo's 'Page size' ('595.276 x 841.89 pts (A4)') as (width, height) in points
+    match = page_size_pattern.match(page_size or '')
+    if not match:
+        return default_page_size
+    return float(match.group(1)), float(match.group(2))
+
+
+def estimate_job_mb(page_count, page_size, settings, chunk_size):
+    # Rendering is chunked, so a job holds at most chunk_size pages, however long the file is
+    width, height = parse_page_size(page_size)
+    pixels = (width / 72 * settings['dpi']) * (height / 72 * settings['dpi'])
+    bytes_per_pixel = 1 if settings['grayscale'] else 3
+    pages_held = min(page_count or chunk_size, chunk_size)
+    return worker_base_mb + pages_held * pixels * bytes_per_pixel * image_copies / 1048576
+
+
+def estimate_job_cpu(settings):
+    # Poppler's render threads and the page encoder threads overlap, so the larger of the two
+    return max(1, settings['thread_count'] or 1, settings['encode_threads'])
+
+
+def read_available_mb():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def read_memory_pressure():
+    # Share of the last 10 seconds some task was stalled on memory, or None without PSI
+    try:
+        with open('/proc/pressure/memory') as f:
+            for line in f:
+                if line.startswith('some'):
+                    return float(line.split()[1].split('=')[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def start(workers):
+    # Budget and in-flight totals for one run
+    available_mb = read_available_mb()
+    budget_mb = memory_budget_mb or (available_mb * memory_budget_share if available_mb else None)
+    budget = {
+        'memory_mb': budget_mb,
+        'cpu': cpu_budget or os.cpu_count() or 1,
+        'max_jobs': workers,
+        'in_flight_mb': 0.0,
+        'in_flight_cpu': 0,
+        'jobs': 0,
+    }
+    logging.info(f"Admission budget: {f'{budget_mb:.0f} MB' if budget_mb else 'no memory limit'}, "
+                 f"{budget['cpu']} cores, {workers} jobs.")
+    return budget
+
+
+def new_job(name, call, estimate_mb, cpu, split=False, pages=None):
+    # pages is the (first, last) range of a split file's job
+    return {'name': name, 'call': call, 'estimate_mb': estimate_mb, 'cpu': cpu, 'split': split, 'pages': pages,
+            'queued_at': time.monotonic(), 'deferred': None}
+
+
+def deferral_reason(budget, job):
+    # Why job cannot start yet, or None when it can
+    if budget['jobs'] >= budget['max_jobs']:
+        return 'all workers busy'
+    if budget['jobs'] == 0:
+        return None
+    if budget['memory_mb'] and budget['in_flight_mb'] + job['estimate_mb'] > budget['memory_mb']:
+        return f"memory budget ({budget['in_flight_mb']:.0f} MB in flight)"
+    if budget['in_flight_cpu'] + job['cpu'] > budget['cpu']:
+        return f"CPU budget ({budget['in_flight_cpu']} cores in flight)"
+    pressure = read_memory_pressure()
+    if pressure is not None and pressure > psi_memory_limit:
+        return f"memory pressure (PSI some avg10 {pressure:.1f}%)"
+    available_mb = read_available_mb()
+    if available_mb is not None and available_mb - job['estimate_mb'] < min_available_mb:
+        return f"low available memory ({available_mb:.0f} MB)"
+    if os.getloadavg()[0] / (os.cpu_count() or 1) > max_load_per_core:
+        return f"load average {os.getloadavg()[0]:.1f}"
+    return None
+
+
+def admit(budget, job):
+    # Reserve the job's share of the budget if it may start now; logs each decision
+    reason = deferral_reason(budget, job)
+    if reason is not None:
+        if reason != job['deferred'] and reason != 'all workers busy':
+            logging.info(f"Deferred '{job['name']}' ({job['estimate_mb']:.0f} MB est.): {reason}.")
+        job['deferred'] = reason
+        return False
+
+    wait_ms = (time.monotonic() - job['queued_at']) * 1000
+    budget['in_flight_mb'] += job['estimate_mb']
+    budget['in_flight_cpu'] += job['cpu']
+    budget['jobs'] += 1
+    metrics.record('admission_wait', wait_ms, job['name'])
+    logging.info(f"Admitted '{job['name']}' ({job['estimate_mb']:.0f} MB est., {budget['in_flight_mb']:.0f} MB and "
+                 f"{budget['in_flight_cpu']} cores in flight) after waiting {wait_ms / 1000:.1f}s.")
+    return True
+
+
+def release(budget, job):
+    budget['in_flight_mb'] -= job['estimate_mb']
+    budget['in_flight_cpu'] -= job['cpu']
+    budget['jobs'] -= 1
@@ -1,133 +1,278 @@
-import paramiko
 import os
+import time
 import datetime
-import sqlite3
 import logging
 import base64
+import shlex
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import database
+import logging_setup
+import metrics
 
-# Define the path to the log file
-log_file_path = 'logs/pdf_convert.log'
+# Define the remote directory path
+remote_directory = "/home/trellissoft/temp_files/"
 
-# Check if the log file exists, if not, create it
-if not os.path.exists(log_file_path):
-    os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
-    with open(log_file_path, 'w'):
-        pass
+# Define default directories
+default_directories = ['input', 'processing', 'completed', 'failed', 'deleted', 'reports', 'logs']
+
+# Number of SFTP channels used to download files concurrently
+default_download_workers = 8
+
+# SourceFile names looked up per bulk query, kept under SQLite's bound-parameter limit
+lookup_chunk_size = 500
+
+# Downloads are written under this suffix and renamed into place once their size checks out,
+# so an interrupted transfer leaves a partial file that the next run resumes from
+partial_suffix = '.part'
+copy_block_size = 1024 * 1024
 
-# Set up logging
-logging.basicConfig(filename=log_file_path, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Function to decode Base64 encoded variables
 def decode_variable(encoded_variable):
     decoded_variable = base64.b64decode(encoded_variable.encode()).decode()
     return decoded_variable
 
-# Fetch encoded environment variables for SSH connection and decode it
-host = decode_variable(os.environ.get('SSH_HOST'))
-username = decode_variable(os.environ.get('SSH_USERNAME'))
-password = decode_variable(os.environ.get('SSH_PASSWORD'))
-port = int(decode_variable(os.environ.get('SSH_PORT', '22')))
 
+def connect_ssh():
+    # Imported here so the download helpers can be used with a local SFTP stand-in without paramiko
+    import paramiko
 
-# Create SSH client
-ssh_client = paramiko.SSHClient()
-ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # Fetch encoded environment variables for SSH connection and decode it
+    host = decode_variable(os.environ.get('SSH_HOST'))
+    username = decode_variable(os.environ.get('SSH_USERNAME'))
+    password = decode_variable(os.environ.get('SSH_PASSWORD'))
+    port = int(decode_variable(os.environ.get('SSH_PORT', '22')))
 
-try:
+    # Create SSH client
+    ssh_client = paramiko.SSHClient()
+    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     ssh_client.connect(hostname=host, port=port, username=username, password=password)
     logging.info("SSH connection established.")
-    
-    # Open SFTP connection
-    ftp = ssh_client.open_sftp()
-    logging.info("SFTP connection established.")
+    return ssh_client
+
+
+def list_remote_pdf_files(ftp, remote_folder_path):
+    # listdir_attr returns names and sizes in one round-trip instead of a stat per file
+    return {attr.filename: attr.st_size for attr in ftp.listdir_attr(remote_folder_path) if attr.filename.endswith('.pdf')}
+
+
+def get_downloaded_files(cursor, file_names, date):
+    # Find which of the given files were already downloaded on the date, a chunk of names per query
+    day_start, day_end = database.day_range(date)
+    file_names = list(file_names)
+    downloaded = set()
+    for start in range(0, len(file_names), lookup_chunk_size):
+        chunk = file_names[start:start + lookup_chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor.execute(f'''SELECT source_file FROM SourceFile
+                           WHERE source_file IN ({placeholders})
+                           AND download_datetime >= ? AND download_datetime < ?''',
+                       (*chunk, day_start, day_end))
+        downloaded.update(row[0] for row in cursor.fetchall())
+    return downloaded
 
-    # Define the remote directory path
-    remote_directory = "/home/trellissoft/temp_files/"
 
-    # Get today's date in the format YYMMDD
-    today_date_yymmdd = datetime.date.today().strftime("%y%m%d")
+def hash_local_file(path, digest):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(copy_block_size), b''):
+            digest.update(block)
 
-    # Get today's date in the format YYYY-MM-DD
-    today_date_yyyymmdd = datetime.date.today().strftime("%Y-%m-%d")
 
-    # Define default directories
-    default_directories = ['input', 'processing', 'completed', 'failed', 'deleted', 'reports', 'logs']
+def get_remote_hash(ssh_client, remote_file_path):
+    # Ask the server for the file's SHA-256 so the local copy can be checked end to end
+    _, stdout, _ = ssh_client.exec_command(f"sha256sum -- {shlex.quote(remote_file_path)}")
+    output = stdout.read().decode().split()
+    if not output:
+        raise IOError(f"Could not read remote hash of '{remote_file_path}'")
+    return output[0]
 
-    # Create directories if they don't exist
-    for directory in default_directories:
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-            logging.info(f"Directory '{directory}' created.")
 
-    # Check if the same folder exists remotely
-    remote_folder_path = os.path.join(remote_directory, today_date_yymmdd)
+def fetch_file(ftp, remote_file_path, local_file_path, remote_size):
+    # Download one file through a partial file, resuming from whatever an earlier run left behind.
+    # Returns the SHA-256 of the complete file and the number of bytes actually transferred.
+    digest = hashlib.sha256()
+
+    # A complete file without a DB row (interrupted between rename and insert) only needs hashing
+    if os.path.exists(local_file_path) and os.path.getsize(local_file_path) == remote_size:
+        hash_local_file(local_file_path, digest)
+        return digest.hexdigest(), 0
+
+    partial_path = local_file_path + partial_suffix
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    if offset > remote_size:
+        # The remote file changed since the partial download started; start over
+        offset = 0
+    if offset:
+        hash_local_file(partial_path, digest)
+        logging.info(f"Resuming '{os.path.basename(local_file_path)}' from byte {offset} of {remote_size}.")
+
+    with ftp.open(remote_file_path, 'rb') as remote_file, open(partial_path, 'ab' if offset else 'wb') as local_file:
+        remote_file.seek(offset)
+        if hasattr(remote_file, 'prefetch'):
+            # Pipeline the remaining read requests instead of waiting on each block in turn
+            remote_file.prefetch(remote_size)
+        for block in iter(lambda: remote_file.read(copy_block_size), b''):
+            local_file.write(block)
+            digest.update(block)
+        local_file.flush()
+        os.fsync(local_file.fileno())
+
+    local_size = os.path.getsize(partial_path)
+    if local_size != remote_size:
+        if local_size > remote_size:
+            os.remove(partial_path)
+        raise IOError(f"Size mismatch for '{remote_file_path}': expected {remote_size} bytes, got {local_size}")
+
+    os.replace(partial_path, local_file_path)
+    return digest.hexdigest(), remote_size - offset
+
+
+def download_files(sftp_factory, remote_folder_path, local_download_directory, files, workers=default_download_workers,
+                   on_downloaded=None, remote_hash=None):
+    # Download {name: size} files over a pool of SFTP channels, one per worker thread.
+    # sftp_factory() must return a new client exposing open() and close(), so a local stand-in can replace paramiko.
+    # remote_hash, if given, maps a remote path to its expected SHA-256 and each download is checked against it.
+    thread_state = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def download(pdf_file):
+        if not hasattr(thread_state, 'ftp'):
+            thread_state.ftp = sftp_factory()
+            with clients_lock:
+                clients.append(thread_state.ftp)
+        remote_file_path = os.path.join(remote_folder_path, pdf_file)
+        local_file_path = os.path.join(local_download_directory, pdf_file)
+        with metrics.timed('download', pdf_file) as sample:
+            content_hash, transferred = fetch_file(thread_state.ftp, remote_file_path, local_file_path, files[pdf_file])
+            sample['bytes'] = transferred
+        if remote_hash is not None and remote_hash(remote_file_path) != content_hash:
+            os.remove(local_file_path)
+            raise IOError(f"Hash mismatch for '{remote_file_path}'")
+        logging.info(f"Downloaded '{pdf_file}' from '{remote_file_path}' to '{local_file_path}'.")
+        return local_file_path, content_hash, transferred
+
+    downloaded_bytes = 0
+    downloaded_count = 0
+    start_time = time.monotonic()
     try:
-        folder_attributes = ftp.stat(remote_folder_path)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(download, pdf_file): pdf_file for pdf_file in files}
+            for future in as_completed(futures):
+                pdf_file = futures[future]
+                try:
+                    local_file_path, content_hash, transferred = future.result()
+                except Exception as e:
+                    logging.error(f"Error downloading '{pdf_file}': {str(e)}")
+                    continue
+                downloaded_bytes += transferred
+                downloaded_count += 1
+                if on_downloaded is not None:
+                    on_downloaded(pdf_file, local_file_path, files[pdf_file], content_hash)
+    finally:
+        for client in clients:
+            client.close()
+        metrics.flush()
+
+    # Report aggregate throughput for the batch
+    elapsed = time.monotonic() - start_time
+    if downloaded_count and elapsed > 0:
+        logging.info(f"Downloaded {downloaded_count} files ({downloaded_bytes / 1048576:.1f} MB transferred) with {workers} channel(s) "
+                     f"in {elapsed:.1f}s: {downloaded_bytes / 1048576 / elapsed:.2f} MB/s.")
+    return downloaded_count, downloaded_bytes
+
+
+def download_pdf_files(ssh_client, workers=default_download_workers, verify_hash=False, on_downloaded=None):
+    # on_downloaded(local_file_path), if given, is called once each new file is on disk and recorded
+    # Open SFTP connection
+    ftp = ssh_client.open_sftp()
+    logging.info("SFTP connection established.")
+    try:
+        # Get today's date in the format YYMMDD
+        today_date_yymmdd = datetime.date.today().strftime("%y%m%d")
+
+        # Get today's date in the format YYYY-MM-DD
+        today_date_yyyymmdd = datetime.date.today().strftime("%Y-%m-%d")
+
+        # Create directories if they don't exist
+        for directory in default_directories:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+                logging.info(f"Directory '{directory}' created.")
+
+        # Check if the same folder exists remotely
+        remote_folder_path = os.path.join(remote_directory, today_date_yymmdd)
+        try:
+            remote_files = list_remote_pdf_files(ftp, remote_folder_path)
+        except FileNotFoundError:
+            logging.error(f"The folder '{remote_folder_path}' does not exist remotely.")
+            return
         logging.info(f"The folder '{remote_folder_path}' exists remotely.")
 
-        # Connect to SQLite database
-        conn = sqlite3.connect('conversion.db')
+        if not remote_files:
+            logging.info(f"No .pdf files found in '{remote_folder_path}'.")
+            return
+
+        # Connect to SQLite database (creates the tables if needed)
+        conn = database.get_connection()
         cursor = conn.cursor()
 
-        # Create table if not exists
-        cursor.execute('''CREATE TABLE IF NOT EXISTS SourceFile 
-                          (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                          source_file TEXT, 
-                          local_file TEXT, 
-                          file_size INTEGER, 
-                          status TEXT, 
-                          download_datetime TEXT,
-                          updated_datetime TEXT)''')
-
-        # Download .pdf files if the folder exists
-        pdf_files = [file for file in ftp.listdir(remote_folder_path) if file.endswith('.pdf')]
-        if pdf_files:
-            for pdf_file in pdf_files:
-                # Check if the file has been downloaded today
-                cursor.execute('''SELECT * FROM SourceFile WHERE source_file=? AND download_datetime LIKE ?''', (pdf_file, f'{today_date_yyyymmdd}%'))
-                existing_entry = cursor.fetchone()
-
-                # If the file hasn't been downloaded today, download it
-                if not existing_entry:
-                    local_download_directory = os.path.join(os.getcwd(), 'input', today_date_yymmdd)
-                    if not os.path.exists(local_download_directory):
-                        os.makedirs(local_download_directory)
-                        logging.info(f"Local directory '{local_download_directory}' created.")
-                    
-                    remote_file_path = os.path.join(remote_folder_path, pdf_file)
-                    local_file_path = os.path.join(local_download_directory, pdf_file)
-                    
-                    try:
-                        ftp.get(remote_file_path, local_file_path)
-                        logging.info(f"Downloaded '{pdf_file}' from '{remote_file_path}' to '{local_file_path}'.")
-                            
-                        # Insert record into SQLite database
-                        file_size = ftp.stat(remote_file_path).st_size
-                        download_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        relative_file_path = os.path.relpath(local_file_path, os.getcwd())
-                        cursor.execute('''INSERT INTO SourceFile 
-                                          (source_file, local_file, file_size, status, download_datetime, updated_datetime) 
-                                          VALUES (?, ?, ?, ?, ?, ?)''', 
-                                          (pdf_file, relative_file_path, file_size, 'pending', download_datetime, download_datetime))
-                        conn.commit()
-                        logging.info(f"Inserted '{pdf_file}' into the database.")
-                    except Exception as e:
-                        logging.error(f"Error downloading '{pdf_file}': {str(e)}")
-                else:
-                    logging.info(f"Skipping '{pdf_file}' as it has already been downloaded today.")
-        else:
-            logging.info(f"No .pdf files found in '{remote_folder_path}'.")
-    except FileNotFoundError:
-        logging.error(f"The folder '{remote_folder_path}' does not exist remotely.")
+        # Check which files have been downloaded today with one bulk lookup
+        already_downloaded = get_downloaded_files(cursor, remote_files, today_date_yyyymmdd)
+        for pdf_file in sorted(already_downloaded):
+            logging.info(f"Skipping '{pdf_file}' as it has already been downloaded today.")
+        pending_files = {name: size for name, size in remote_files.items() if name not in already_downloaded}
+        if not pending_files:
+            return
+
+        local_download_directory = os.path.join(os.getcwd(), 'input', today_date_yymmdd)
+        if not os.path.exists(local_download_directory):
+            os.makedirs(local_download_directory)
+            logging.info(f"Local directory '{local_download_directory}' created.")
 
-except Exception as e:
-    logging.error(f"An error occurred: {str(e)}")
+        def record_download(pdf_file, local_file_path, file_size, content_hash):
+            # Insert record into SQLite database; runs on the main thread as each download finishes
+            download_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            relative_file_path = os.path.relpath(local_file_path, os.getcwd())
+            cursor.execute('''INSERT INTO SourceFile
+                              (source_file, local_file, file_size, status, download_datetime, updated_datetime, content_hash)
+                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                           (pdf_file, relative_file_path, file_size, 'pending', download_datetime, download_datetime, content_hash))
+            conn.commit()
+            logging.info(f"Inserted '{pdf_file}' into the database.")
+            if on_downloaded is not None:
+                on_downloaded(local_file_path)
 
-finally:
-    # Close connections
-    if 'ftp' in locals():
+        remote_hash = (lambda path: get_remote_hash(ssh_client, path)) if verify_hash else None
+        download_files(ssh_client.open_sftp, remote_folder_path, local_download_directory, pending_files,
+                       workers=workers, on_downloaded=record_download, remote_hash=remote_hash)
+    finally:
         ftp.close()
-    if 'ssh_client' in locals():
-        ssh_client.close()
-    if 'conn' in locals():
-        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download today's PDFs from the SFTP server.")
+    parser.add_argument("--workers", type=int, default=default_download_workers, help="Number of concurrent SFTP channels.")
+    parser.add_argument("--verify-hash", action="store_true", help="Check each download against the server's sha256sum.")
+    args = parser.parse_args()
+    logging_setup.setup_logging()
+
+    ssh_client = None
+    try:
+        ssh_client = connect_ssh()
+        download_pdf_files(ssh_client, workers=args.workers, verify_hash=args.verify_hash)
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+    finally:
+        # Close connections
+        if ssh_client is not None:
+            ssh_client.close()
+        metrics.write_textfile()
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import gzip
+import queue
+import shutil
+import fcntl
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, date
+
+# Every command logs to the same file
+log_file = 'logs/pdf_convert.log'
+
+# Records are written one JSON object per line; set to False for the old plain text lines
+json_logs = True
+
+# The log is rotated once it reaches max_log_bytes, and at the first write of a new day
+max_log_bytes = 50 * 1024 * 1024
+rotate_daily = True
+
+# Rotated logs kept (gzipped) before the oldest is removed
+backup_count = 14
+
+# Fields callers can pass with extra={...} that are written as their own JSON keys
+structured_fields = ('file', 'page', 'stage')
+
+_listener = None
+_fork_hook_registered = False
+_exit_registered_pid = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'process': record.process,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        for field in structured_fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, default=str)
+
+
+class SharedRotatingFileHandler(logging.handlers.WatchedFileHandler):
+    # Rotates by size or day while several processes append to the same file. The rotation itself
+    # runs under an flock; every other process notices the new inode on its next write and reopens,
+    # as WatchedFileHandler does. A process can still append a last line to the file just rotated,
+    # so each rotation gzips the ones before it rather than the file it has just renamed.
+    def __init__(self, filename):
+        super().__init__(filename, encoding='utf-8')
+        self.lock_file = filename + '.lock'
+
+    def should_rotate(self):
+        stat = os.fstat(self.stream.fileno())
+        if max_log_bytes and stat.st_size >= max_log_bytes:
+            return True
+        return rotate_daily and stat.st_size > 0 and date.fromtimestamp(stat.st_mtime) < date.today()
+
+    def rotate(self):
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have rotated while this one waited for the lock
+            self.reopenIfNeeded()
+            if self.should_rotate():
+                rotated = f"{self.baseFilename}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+                os.rename(self.baseFilename, rotated)
+                self.reopenIfNeeded()
+                compress_rotated_logs(self.baseFilename, keep_plain=rotated)
+
+    def emit(self, record):
+        try:
+            if self.stream is not None and self.should_rotate():
+                self.rotate()
+        except Exception:
+            self.handleError(record)
+        super().emit(record)
+
+
+def compress_rotated_logs(base_file, keep_plain=None):
+    # Gzip every rotated log except keep_plain, then drop all but the newest backup_count
+    folder = os.path.dirname(base_file) or '.'
+    prefix = os.path.basename(base_file) + '.'
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if not name.startswith(prefix) or name.endswith(('.gz', '.lock')) or path == keep_plain:
+            continue
+        with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+        os.remove(path)
+    rotated = sorted(name for name in os.listdir(folder) if name.startswith(prefix) and not name.endswith('.lock'))
+    for name in rotated[:-backup_count] if backup_count else []:
+        os.remove(os.path.join(folder, name))
+
+
+def start_listener():
+    # Callers only put records on an in-memory queue; one thread per process formats them and writes
+    # the file, so a slow disk never holds up the page loop
+    global _listener
+    file_handler = SharedRotatingFileHandler(log_file)
+    if json_logs:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+
+def stop_logging():
+    # Write out whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def register_exit():
+    # Write out the queue when this process exits
+    global _exit_registered_pid
+    atexit.register(stop_logging)
+    if 'multiprocessing' in sys.modules:
+        # Pool workers leave through os._exit, which skips atexit but runs multiprocessing finalizers
+        from multiprocessing import util
+        util.Finalize(None, stop_logging, exitpriority=10)
+    _exit_registered_pid = os.getpid()
+
+
+def restart_in_child():
+    # A forked child inherits the queue handler but not the listener thread, so it gets its own
+    global _listener
+    if _listener is not None:
+        _listener = None
+        start_listener()
+
+
+def setup_logging():
+    # Called from each command's main(), never at import, so importing a module has no side effects.
+    # Pool workers call it from their initializer too, which is what flushes their queue when they exit.
+    global _fork_hook_registered
+    if _listener is None:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        start_listener()
+    if not _fork_hook_registered:
+        os.register_at_fork(after_in_child=restart_in_child)
+        _fork_hook_registered = True
+    if _exit_registered_pid != os.getpid():
+        register_exit()
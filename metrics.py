@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+import threading
+import functools
+from datetime import datetime
+from contextlib import contextmanager
+import database
+
+# Samples are buffered in memory and written to the Metrics table in batches, so timing a
+# hot path never costs a commit of its own
+flush_threshold = 500
+
+# Optional Prometheus textfile (for the node exporter's textfile collector) refreshed by write_textfile()
+textfile_path = os.environ.get('METRICS_TEXTFILE')
+
+_samples = []
+_samples_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def record(stage, duration_ms, source_file=None, page=None, bytes_count=None, pages=None):
+    global _samples, _samples_pid
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with _lock:
+        if _samples_pid != os.getpid():
+            # A forked worker starts with its parent's unflushed samples; drop them to avoid duplicates
+            _samples = []
+            _samples_pid = os.getpid()
+        _samples.append((stage, source_file, page, duration_ms, bytes_count, pages, now))
+        should_flush = len(_samples) >= flush_threshold
+    if should_flush:
+        flush()
+
+
+@contextmanager
+def timed(stage, source_file=None, page=None):
+    # Time a block; the block may fill in sample['bytes'] and sample['pages'] before it exits
+    sample = {'bytes': None, 'pages': None}
+    start_time = time.perf_counter()
+    try:
+        yield sample
+    finally:
+        record(stage, (time.perf_counter() - start_time) * 1000, source_file, page, sample['bytes'], sample['pages'])
+
+
+def timed_function(stage):
+    # Decorator form of timed() for whole functions
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush():
+    global _samples
+    with _lock:
+        if _samples_pid != os.getpid() or not _samples:
+            return
+        samples, _samples = _samples, []
+    conn = None
+    try:
+        conn = database.get_connection()
+        conn.executemany('''INSERT INTO Metrics
+                            (stage, source_file, page, duration_ms, bytes, pages, recorded_datetime)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', samples)
+        conn.commit()
+    except Exception as e:
+        logging.error(f"Error writing metrics: {str(e)}")
+        # The connection is shared with the rest of the process; do not leave it inside a transaction
+        if conn is not None:
+            conn.rollback()
+
+
+def get_stage_latencies(conn, date):
+    # p50/p95 duration per stage for one day, as {stage: (count, p50_ms, p95_ms)}
+    day_start, day_end = database.day_range(date)
+    rows = conn.execute('''SELECT stage, duration_ms FROM Metrics
+                           WHERE recorded_datetime >= ? AND recorded_datetime < ?
+                           ORDER BY stage, duration_ms''', (day_start, day_end)).fetchall()
+    durations = {}
+    for stage, duration_ms in rows:
+        durations.setdefault(stage, []).append(duration_ms)
+    latencies = {}
+    for stage, values in durations.items():
+        latencies[stage] = (len(values), percentile(values, 50), percentile(values, 95))
+    return latencies
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile of an already sorted list
+    index = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def write_textfile(path=None):
+    # Write today's per-stage totals and latencies in the Prometheus text format
+    path = path or textfile_path
+    if not path:
+        return
+    flush()
+    try:
+        conn = database.get_connection()
+        day_start, day_end = database.day_range(datetime.now().strftime("%Y-%m-%d"))
+        totals = conn.execute('''SELECT stage, COUNT(*), SUM(duration_ms), COALESCE(SUM(bytes), 0), COALESCE(SUM(pages), 0)
+                                 FROM Metrics WHERE recorded_datetime >= ? AND recorded_datetime < ?
+                                 GROUP BY stage''', (day_start, day_end)).fetchall()
+        latencies = get_stage_latencies(conn, datetime.now().strftime("%Y-%m-%d"))
+
+        lines = [
+            "# HELP pdf_convert_stage_calls Timed calls per stage today.",
+            "# TYPE pdf_convert_stage_calls gauge",
+        ]
+        lines += [f'pdf_convert_stage_calls{{stage="{stage}"}} {count}' for stage, count, _, _, _ in totals]
+        lines += ["# HELP pdf_convert_stage_seconds Time spent per stage today.", "# TYPE pdf_convert_stage_seconds gauge"]
+        lines += [f'pdf_convert_stage_seconds{{stage="{stage}"}} {total_ms / 1000:.6f}' for stage, _, total_ms, _, _ in totals]
+        lines += ["# HELP pdf_convert_stage_bytes Bytes handled per stage today.", "# TYPE pdf_convert_stage_bytes gauge"]
+        lines += [f'pdf_convert_stage_bytes{{stage="{stage}"}} {total_bytes}' for stage, _, _, total_bytes, _ in totals]
+        lines += ["# HELP pdf_convert_stage_pages Pages handled per stage today.", "# TYPE pdf_convert_stage_pages gauge"]
+        lines += [f'pdf_convert_stage_pages{{stage="{stage}"}} {total_pages}' for stage, _, _, _, total_pages in totals]
+        lines += ["# HELP pdf_convert_stage_latency_seconds Stage latency quantiles today.", "# TYPE pdf_convert_stage_latency_seconds gauge"]
+        for stage, (_, p50, p95) in latencies.items():
+            lines.append(f'pdf_convert_stage_latency_seconds{{stage="{stage}",quantile="0.5"}} {p50 / 1000:.6f}')
+            lines.append(f'pdf_convert_stage_latency_seconds{{stage="{stage}",quantile="0.95"}} {p95 / 1000:.6f}')
+
+        # Write to a temporary name and rename so the exporter never reads a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+    except Exception as e:
+        logging.error(f"Error writing metrics textfile: {str(e)}")
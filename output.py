@@ -1,16 +1,140 @@
 import os
 import shutil
-import sqlite3
+import argparse
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import database
+import logging_setup
+import metrics
+import placement
+from delete import get_folder_usage
+
+processing_folder = "processing/"
+completed_folder = "completed/"
+input_folder = "input/"
+
+# Concurrent folder copies when processing/ and completed/ are on different filesystems
+default_copy_workers = 4
+
+# File names per status lookup query, kept under SQLite's bound-parameter limit
+lookup_chunk_size = 500
+
+# Statuses of files that still need their input file: not converted yet, or converted but not moved
+# to completed (with a deferred original the input is the only copy). Failed files keep a copy in failed/.
+unfinished_statuses = ('pending', 'processing', 'Completed')
+
+_totals_lock = threading.Lock()
+
+def same_filesystem(source_folder, destination_folder):
+    # Renames are only atomic (and only possible) within one filesystem
+    return os.stat(source_folder).st_dev == os.stat(destination_folder).st_dev
+
+def place_folder(source_path, destination_path, rename):
+    # Put a converted file's folder in place, returning (bytes, files). Within one filesystem this is
+    # a single rename; across filesystems the folder is copied under a temporary name, renamed into
+    # place once complete, and only then removed from the source.
+    if os.path.exists(destination_path):
+        raise FileExistsError(f"{destination_path} already exists")
+    folder_bytes, folder_files = get_folder_usage(source_path)
+    if rename:
+        os.rename(source_path, destination_path)
+    else:
+        temp_path = f"{destination_path}.{os.getpid()}.tmp"
+        try:
+            shutil.copytree(source_path, temp_path, copy_function=placement.copy_file)
+            os.rename(temp_path, destination_path)
+        except Exception:
+            # Leave nothing half-copied behind in completed/
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        shutil.rmtree(source_path)
+    return folder_bytes, folder_files
+
+def move_folder_to_completed(conn, processing_folder_today, completed_folder_today, file_name, rename=None, totals=None):
+    # Move one converted file's folder to completed. With a conn its source file is marked as done
+    # straight away; without one the caller batches the updates.
+    source_path = os.path.join(processing_folder_today, file_name)
+    destination_path = os.path.join(completed_folder_today, file_name)
+    logging.info(f"Moving file {file_name} to completed folder...")
+
+    # Check if source file exists
+    if not os.path.exists(source_path):
+        logging.error(f"Source file {source_path} does not exist.")
+        return False
 
-def move_files_to_completed():
     try:
-        # Constants
-        processing_folder = "processing/"
-        completed_folder = "completed/"
-        input_folder = "input/"
-
+        # An original left in input/ (conversion.py --defer-original) moves into the folder first
+        input_file = os.path.join(input_folder, os.path.basename(os.path.normpath(processing_folder_today)), file_name + ".pdf")
+        if os.path.isfile(input_file):
+            placement.place_original(input_file, source_path, move=True)
+
+        if rename is None:
+            rename = same_filesystem(processing_folder_today, completed_folder_today)
+
+        # Move file
+        with metrics.timed('move', file_name + ".pdf") as sample:
+            sample['bytes'], sample['pages'] = place_folder(source_path, destination_path, rename)
+        if totals is not None:
+            with _totals_lock:
+                totals['renamed' if rename else 'copied'] += sample['bytes']
+        logging.info(f"File {file_name} {'renamed' if rename else 'copied'} to completed folder ({sample['bytes']} bytes).")
+
+        # Update SourceFile table
+        if conn is not None:
+            mark_done(conn, [file_name])
+        return True
+    except Exception as e:
+        logging.error(f"Error moving file {file_name}: {str(e)}")
+        return False
+
+def get_statuses(conn, file_names):
+    # Latest SourceFile status of each of the given PDF names, a chunk of names per query
+    file_names = list(file_names)
+    statuses = {}
+    for start in range(0, len(file_names), lookup_chunk_size):
+        chunk = file_names[start:start + lookup_chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        rows = conn.execute(f'''SELECT source_file, status FROM SourceFile
+                                WHERE id IN (SELECT MAX(id) FROM SourceFile
+                                             WHERE source_file IN ({placeholders}) GROUP BY source_file)''', chunk)
+        statuses.update(rows.fetchall())
+    return statuses
+
+def mark_done(conn, file_names):
+    # Mark the source files of completed folders as done, in one transaction
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany('''UPDATE SourceFile 
+                        SET status=?, updated_datetime=? 
+                        WHERE source_file=?''', 
+                     [('Done', now, file_name + ".pdf") for file_name in file_names])
+    conn.commit()
+
+def complete_file(input_file, date_folder):
+    # Complete a single converted PDF as soon as its pages are written: move its folder from
+    # processing/<date_folder> to today's completed folder and remove the downloaded input file.
+    # completed/ is dated by completion, so a file a catch-up run completes days after its download
+    # still gets the full retention period.
+    conn = database.get_connection()
+    file_name = os.path.basename(input_file)
+    row = conn.execute('''SELECT status FROM SourceFile WHERE source_file=?''', (file_name,)).fetchone()
+    if not row or row[0] != 'Completed':
+        logging.info(f"Not completing '{file_name}', its conversion did not finish.")
+        return False
+
+    completed_folder_today = os.path.join(completed_folder, datetime.now().strftime("%y%m%d"))
+    os.makedirs(completed_folder_today, exist_ok=True)
+    folder_name = os.path.splitext(file_name)[0]
+    if not move_folder_to_completed(conn, os.path.join(processing_folder, date_folder), completed_folder_today, folder_name):
+        return False
+    if os.path.isfile(input_file):
+        os.remove(input_file)
+        logging.info(f"File '{file_name}' deleted from input folder.")
+    return True
+
+def move_files_to_completed(copy_workers=default_copy_workers):
+    try:
         # Get current date
         today_date = datetime.now().strftime("%y%m%d")
 
@@ -25,49 +149,43 @@ def move_files_to_completed():
         os.makedirs(completed_folder_today, exist_ok=True)
 
         # Connect to SQLite database
-        conn = sqlite3.connect('conversion.db')
-        cursor = conn.cursor()
-
-        # Get list of files in today's processing folder
-        files = os.listdir(processing_folder_today)
-
-        # Iterate through each file
-        for file_name in files:
-            # Move file to completed folder
-            source_path = os.path.join(processing_folder_today, file_name)
-            destination_path = os.path.join(completed_folder_today, file_name)
-            logging.info(f"Moving file {file_name} to completed folder...")
-
-            # Check if source file exists
-            if os.path.exists(source_path):
-                try:
-                    # Move file
-                    shutil.move(source_path, destination_path)
-                    logging.info(f"File {file_name} moved to completed folder.")
-
-                    # Update SourceFile table
-                    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    cursor.execute('''UPDATE SourceFile 
-                                      SET status=?, updated_datetime=? 
-                                      WHERE source_file=?''', 
-                                   ('Done', now, file_name + ".pdf"))
-                    conn.commit()
-                except Exception as e:
-                    logging.error(f"Error moving file {file_name}: {str(e)}")
-            else:
-                logging.error(f"Source file {source_path} does not exist.")
+        conn = database.get_connection()
+        run_started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # Only folders whose conversion completed move; an interrupted file stays in processing/ so its
+        # page jobs can resume it, and a failed one is left to move_to_failed and catch-up
+        folders = os.listdir(processing_folder_today)
+        statuses = get_statuses(conn, [folder + ".pdf" for folder in folders])
+        files = [folder for folder in folders if statuses.get(folder + ".pdf") == 'Completed']
+        if len(files) < len(folders):
+            logging.info(f"Leaving {len(folders) - len(files)} unfinished folder(s) in the processing folder.")
+
+        # Renames are cheap and run in turn; cross-device copies run on a bounded thread pool
+        rename = same_filesystem(processing_folder_today, completed_folder_today)
+        totals = {'renamed': 0, 'copied': 0}
+        workers = 1 if rename else max(1, copy_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda file_name: move_folder_to_completed(None, processing_folder_today, completed_folder_today,
+                                                                              file_name, rename, totals), files)
+            moved = [file_name for file_name, result in zip(files, results) if result]
+
+        # Mark every moved file as done in one transaction
+        if moved:
+            mark_done(conn, moved)
+        logging.info(f"Moved {len(moved)} of {len(files)} folders to completed: "
+                     f"{totals['renamed']} bytes renamed, {totals['copied']} bytes copied.")
+        placement.log_placement_totals(run_started)
 
         # Close the database connection
-        conn.close()
+        metrics.write_textfile()
+        database.close_connection()
         logging.info("All files processed successfully.")
     except Exception as e:
         logging.error(f"Error moving files to completed folder: {str(e)}")
 
+@metrics.timed_function('input_cleanup')
 def delete_input_folder_contents():
     try:
-        # Constants
-        input_folder = "input/"
-
         # Get current date
         today_date = datetime.now().strftime("%y%m%d")
 
@@ -76,10 +194,15 @@ def delete_input_folder_contents():
 
         # Check if the input folder exists
         if os.path.exists(input_folder_today):
+            # Keep the input of every file that has not finished, so its conversion can still be resumed
+            items = os.listdir(input_folder_today)
+            statuses = get_statuses(database.get_connection(), [item for item in items if item.endswith(".pdf")])
             # Iterate through files and directories in the input folder
-            for item in os.listdir(input_folder_today):
+            for item in items:
                 item_path = os.path.join(input_folder_today, item)
-                if os.path.isfile(item_path):
+                if statuses.get(item) in unfinished_statuses:
+                    logging.info(f"Keeping '{item}' in the input folder, it has not finished.")
+                elif os.path.isfile(item_path):
                     # Delete file
                     os.remove(item_path)
                     logging.info(f"File '{item}' deleted from input folder.")
@@ -92,13 +215,18 @@ def delete_input_folder_contents():
     except Exception as e:
         logging.error(f"Error deleting input folder contents: {str(e)}")
 
-# Configure logging
-log_file = 'logs/pdf_convert.log'
-os.makedirs(os.path.dirname(log_file), exist_ok=True)
-logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def main():
+    parser = argparse.ArgumentParser(description="Move today's converted files to the completed folder.")
+    parser.add_argument("--copy-workers", type=int, default=default_copy_workers,
+                        help="Concurrent folder copies when processing/ and completed/ are on different filesystems.")
+    args = parser.parse_args()
+    logging_setup.setup_logging()
+
+    # Call the function to move files to completed folder and update database
+    move_files_to_completed(args.copy_workers)
 
-# Call the function to move files to completed folder and update database
-move_files_to_completed()
+    # Call the function to delete everything from the input folder
+    delete_input_folder_contents()
 
-# Call the function to delete everything from the input folder
-delete_input_folder_contents()
+if __name__ == "__main__":
+    main()
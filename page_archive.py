@@ -0,0 +1,105 @@
+import os
+import shutil
+import struct
+import zipfile
+import threading
+
+# Optional packed layout for a converted document: each output folder (converted/, thumbnails/, and
+# one per extra format) becomes one uncompressed zip next to it, e.g. converted/ -> converted.zip.
+# Images are already compressed, so members are stored as-is and can be read straight from their
+# offset; the zip's central directory is the index. A document then costs a handful of inodes
+# instead of several per page, which is what moving, purging and backing up the output pay for.
+archive_extension = ".zip"
+
+# Folders of a document that are never packed
+unpacked_folders = ('original',)
+
+local_header = struct.Struct('<4sHHHHHIIIHH')
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def archive_path(folder):
+    return os.path.normpath(folder) + archive_extension
+
+
+def read_index(path):
+    # {member name: (data offset, size)} for a stored archive, cached until the file changes
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    index = {}
+    with open(path, 'rb') as f, zipfile.ZipFile(f) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"'{info.filename}' in {path} is compressed")
+            # The data starts after the member's local header, whose name and extra lengths can
+            # differ from the central directory's copy
+            f.seek(info.header_offset)
+            fields = local_header.unpack(f.read(local_header.size))
+            index[info.filename] = (info.header_offset + local_header.size + fields[9] + fields[10], info.file_size)
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+def read_member(path, name, index=None):
+    # One member's bytes, read from its offset without extracting anything else
+    offset, size = (index or read_index(path))[name]
+    with open(path, 'rb') as f:
+        return os.pread(f.fileno(), size, offset)
+
+
+def list_files(folder):
+    # Names of the files a document folder holds, loose or packed
+    names = set(read_index(archive_path(folder))) if os.path.isfile(archive_path(folder)) else set()
+    if os.path.isdir(folder):
+        names.update(entry.name for entry in os.scandir(folder) if entry.is_file())
+    return names
+
+
+def read_file(folder, name):
+    # A page from folder, whether it is still a loose file or has been packed
+    path = os.path.join(folder, name)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return read_member(archive_path(folder), name)
+
+
+def pack_folder(folder):
+    # Pack a folder's files into folder.zip and remove the folder; members already in an existing
+    # archive are kept. The archive is written under a temporary name and renamed into place.
+    # Returns the number of files packed.
+    path = archive_path(folder)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    names = sorted(entry.name for entry in os.scandir(folder) if entry.is_file())
+    if not names:
+        # Nothing new, e.g. the empty folders a re-run recreates; the archive stays as it is
+        shutil.rmtree(folder)
+        return 0
+    with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as archive:
+        if os.path.isfile(path):
+            with zipfile.ZipFile(path) as existing:
+                for info in existing.infolist():
+                    if info.filename not in names:
+                        archive.writestr(info, existing.read(info))
+        for name in names:
+            archive.write(os.path.join(folder, name), name)
+    os.replace(temp_path, path)
+    shutil.rmtree(folder)
+    return len(names)
+
+
+def pack_document(file_folder):
+    # Pack every output folder of one document; returns the number of files packed
+    packed = 0
+    for entry in os.scandir(file_folder):
+        if entry.is_dir() and entry.name not in unpacked_folders:
+            packed += pack_folder(entry.path)
+    return packed
@@ -0,0 +1,136 @@
+import os
+import logging
+from datetime import datetime
+import page_archive
+
+# Every page of a PDF is a PageJob row: pending -> claimed -> done, or failed. Workers claim pages
+# inside a write transaction, so no page is rendered by two workers at once, and a restarted run
+# only renders the pages that are not done. A file is complete once every page is done and its
+# image is on disk. Jobs belong to one download, identified by the file name and the <yymmdd>
+# folder its pages are written to, so a file of the same name on another day has its own jobs.
+
+
+def page_number(page_file):
+    # Page files are named <name>_<page><extension>
+    return int(os.path.splitext(page_file)[0].rsplit('_', 1)[1])
+
+
+def create_jobs(conn, file_name, date_folder, page_count):
+    # Add a pending job for each page that does not have one yet
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany('''INSERT OR IGNORE INTO PageJob
+                        (source_file, date_folder, page, status, attempts, updated_datetime)
+                        VALUES (?, ?, ?, ?, 0, ?)''',
+                     [(file_name, date_folder, page, 'pending', now) for page in range(1, page_count + 1)])
+    conn.commit()
+
+
+def worker_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reconcile(conn, file_name, date_folder, converted_folder):
+    # Put back the work a crashed run left behind: claims held by processes that are gone, and done
+    # pages whose image is missing from disk (their ProcessedFile rows go too, so re-rendering them
+    # does not duplicate rows; each job points at its own row, so rows of other downloads of the same
+    # name stay). Returns the number of pages to render again.
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute('''SELECT page, status, worker_pid, processed_file_id, local_file FROM PageJob
+                           WHERE source_file=? AND date_folder=? AND status IN (?, ?)''',
+                        (file_name, date_folder, 'claimed', 'done')).fetchall()
+    stale_claims = [page for page, status, worker_pid, _, _ in rows
+                    if status == 'claimed' and (worker_pid == os.getpid() or not worker_alive(worker_pid))]
+    on_disk = page_archive.list_files(converted_folder)
+    missing = [(page, processed_file_id) for page, status, _, processed_file_id, local_file in rows
+               if status == 'done' and local_file not in on_disk]
+    conn.executemany('''UPDATE PageJob SET status=?, worker_pid=NULL, updated_datetime=?
+                        WHERE source_file=? AND date_folder=? AND page=?''',
+                     [('pending', now, file_name, date_folder, page)
+                      for page in stale_claims + [page for page, _ in missing]])
+    conn.executemany('''DELETE FROM ProcessedFile WHERE id=?''',
+                     [(processed_file_id,) for _, processed_file_id in missing if processed_file_id is not None])
+    conn.commit()
+    if stale_claims or missing:
+        logging.info(f"Re-queued {len(stale_claims)} abandoned and {len(missing)} missing pages of '{file_name}'.")
+    return len(stale_claims) + len(missing)
+
+
+def claim_pages(conn, file_name, date_folder, first_page, last_page, limit):
+    # Atomically claim up to limit pending or failed pages in [first_page, last_page], lowest first
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute("BEGIN IMMEDIATE")
+    pages = [row[0] for row in conn.execute('''SELECT page FROM PageJob
+                                               WHERE source_file=? AND date_folder=? AND page >= ? AND page <= ?
+                                               AND status IN (?, ?)
+                                               ORDER BY page LIMIT ?''',
+                                            (file_name, date_folder, first_page, last_page, 'pending', 'failed', limit))]
+    conn.executemany('''UPDATE PageJob SET status=?, worker_pid=?, attempts=attempts + 1, updated_datetime=?
+                        WHERE source_file=? AND date_folder=? AND page=?''',
+                     [('claimed', os.getpid(), now, file_name, date_folder, page) for page in pages])
+    conn.commit()
+    return pages
+
+
+def contiguous_runs(pages):
+    # Split sorted page numbers into (first, last) runs that one render call can cover
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page - 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [tuple(run) for run in runs]
+
+
+def mark_done(cursor, file_name, date_folder, page_files, first_id):
+    # Called inside the transaction that wrote the pages' ProcessedFile rows, which got consecutive
+    # ids from first_id in page_files order
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.executemany('''UPDATE PageJob SET status=?, local_file=?, processed_file_id=?, worker_pid=NULL, updated_datetime=?
+                          WHERE source_file=? AND date_folder=? AND page=?''',
+                       [('done', page_file, first_id + index, now, file_name, date_folder, page_number(page_file))
+                        for index, page_file in enumerate(page_files)])
+
+
+def mark_failed(conn, file_name, date_folder, pages):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany('''UPDATE PageJob SET status=?, worker_pid=NULL, updated_datetime=?
+                        WHERE source_file=? AND date_folder=? AND page=? AND status=?''',
+                     [('failed', now, file_name, date_folder, page, 'claimed') for page in pages])
+    conn.commit()
+
+
+def get_live_claims(conn, file_name, date_folder):
+    # Pages of the download another running process has claimed and not finished yet
+    rows = conn.execute('''SELECT page, worker_pid FROM PageJob WHERE source_file=? AND date_folder=? AND status=?''',
+                        (file_name, date_folder, 'claimed')).fetchall()
+    return [page for page, worker_pid in rows if worker_pid != os.getpid() and worker_alive(worker_pid)]
+
+
+def get_last_update(conn, file_name, date_folder):
+    # When any page of the download was last claimed, finished or re-queued, or None without jobs
+    return conn.execute('''SELECT MAX(updated_datetime) FROM PageJob WHERE source_file=? AND date_folder=?''',
+                        (file_name, date_folder)).fetchone()[0]
+
+
+def get_done_pages(conn, file_name, date_folder):
+    return {row[0] for row in conn.execute('''SELECT page FROM PageJob WHERE source_file=? AND date_folder=? AND status=?''',
+                                           (file_name, date_folder, 'done'))}
+
+
+def is_complete(conn, file_name, date_folder, page_count, converted_folder):
+    # True when each of the file's pages has a done job and its image is on disk, loose or packed
+    if not page_count:
+        return False
+    rows = conn.execute('''SELECT page, local_file FROM PageJob WHERE source_file=? AND date_folder=? AND status=?''',
+                        (file_name, date_folder, 'done')).fetchall()
+    on_disk = page_archive.list_files(converted_folder)
+    pages = {page for page, local_file in rows if local_file in on_disk}
+    return pages >= set(range(1, page_count + 1))
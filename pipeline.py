@@ -0,0 +1,225 @@
+import os
+import time
+import queue
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import database
+import logging_setup
+import metrics
+import conversion
+import output
+import watcher
+import catchup
+import input as downloader
+
+# Marks the end of a queue's input
+end_of_queue = None
+
+
+def queue_pending_files(convert_queue):
+    # Downloaded files still waiting in today's input folder (e.g. from a run that stopped early)
+    today_date = datetime.now().strftime("%y%m%d")
+    input_folder_today = os.path.join(conversion.input_folder, today_date)
+    if not os.path.exists(input_folder_today):
+        return 0
+    conn = database.get_connection()
+    pending = {row[0] for row in conn.execute('''SELECT source_file FROM SourceFile WHERE status=?''', ('pending',))}
+    pdf_files = [os.path.join(input_folder_today, file) for file in sorted(os.listdir(input_folder_today))
+                 if file.endswith(".pdf") and file in pending]
+
+    # Pre-scanned, with unreadable files failed and the rest fewest pages first
+    pdf_files, _ = conversion.schedule_files(pdf_files)
+    for input_file in pdf_files:
+        convert_queue.put(input_file)
+    return len(pdf_files)
+
+
+def download_stage(convert_queue, download_workers, download):
+    # Feed the convert queue: leftovers first, then each file the moment its download is recorded
+    try:
+        queued = queue_pending_files(convert_queue)
+        if queued:
+            logging.info(f"Queued {queued} pending file(s) from the input folder.")
+        if download:
+            ssh_client = downloader.connect_ssh()
+            try:
+                downloader.download_pdf_files(ssh_client, workers=download_workers, on_downloaded=convert_queue.put)
+            finally:
+                ssh_client.close()
+    except Exception as e:
+        logging.error(f"Error in download stage: {str(e)}")
+    finally:
+        database.close_connection()
+        convert_queue.put(end_of_queue)
+
+
+def watch_stage(convert_queue, stop_event, on_idle=None, use_inotify=True):
+    # Feed the convert queue from the input folder as files finish arriving, until stopped. Files that
+    # already converted, or are being converted, are left alone.
+    def on_ready(path):
+        row = database.get_connection().execute('''SELECT status FROM SourceFile WHERE source_file=?
+                                                   ORDER BY id DESC LIMIT 1''', (os.path.basename(path),)).fetchone()
+        if row is None or row[0] in ('pending', 'Failed'):
+            logging.info(f"Queued {path} for conversion.")
+            convert_queue.put(path)
+
+    try:
+        watcher.watch_input_folder(on_ready, stop_event, on_idle, use_inotify=use_inotify)
+    except Exception as e:
+        logging.error(f"Error in watch stage: {str(e)}")
+    finally:
+        database.close_connection()
+        convert_queue.put(end_of_queue)
+
+
+def complete_stage(complete_queue, slots, totals):
+    # Move each converted file to completed as soon as its conversion finishes
+    try:
+        while True:
+            item = complete_queue.get()
+            if item is end_of_queue:
+                break
+            input_file, date_folder, future = item
+            try:
+                exception = future.exception()
+                if exception is not None:
+                    # A job that never ran or whose worker died with the pool; convert_pdf_to_images
+                    # records every other failure itself
+                    logging.error(f"Error converting {input_file}: {str(exception)}")
+                    conversion.fail_file(input_file)
+                    continue
+                totals['pages'] += future.result()
+                if output.complete_file(input_file, date_folder):
+                    totals['completed'] += 1
+            except Exception as e:
+                logging.error(f"Error completing {input_file}: {str(e)}")
+            finally:
+                slots.release()
+    finally:
+        metrics.flush()
+        database.close_connection()
+
+
+def run_pipeline(workers, download_workers, queue_size, download=True, watch=None, on_idle=None, use_inotify=True):
+    # download -> convert -> complete, connected by bounded queues. At most queue_size files are
+    # converting or waiting to be completed at once, which also bounds the complete queue.
+    # With watch (a threading.Event that stops it), files are fed from the input folder as they
+    # arrive instead of from one download pass, and the pipeline runs until the event is set.
+    convert_queue = queue.Queue(maxsize=queue_size)
+    complete_queue = queue.Queue(maxsize=queue_size)
+    slots = threading.BoundedSemaphore(queue_size)
+    totals = {'files': 0, 'pages': 0, 'completed': 0}
+
+    start_time = time.monotonic()
+    if watch is not None:
+        download_thread = threading.Thread(target=watch_stage, args=(convert_queue, watch, on_idle, use_inotify), daemon=True)
+    else:
+        download_thread = threading.Thread(target=download_stage, args=(convert_queue, download_workers, download), daemon=True)
+    complete_thread = threading.Thread(target=complete_stage, args=(complete_queue, slots, totals), daemon=True)
+    download_thread.start()
+    complete_thread.start()
+
+    def start_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=conversion.init_worker,
+                                   initargs=(conversion.get_worker_settings(),))
+
+    executor = start_pool()
+    try:
+        while True:
+            input_file = convert_queue.get()
+            if input_file is end_of_queue:
+                break
+            slots.acquire()
+            date_folder = conversion.get_date_folder(input_file)
+            try:
+                future = executor.submit(conversion.convert_pdf_to_images, input_file, conversion.processing_folder)
+            except BrokenProcessPool:
+                # A worker exited abruptly; the complete stage fails the files it took down, and the
+                # rest of the run (or the watch daemon) goes on with a new pool
+                logging.error("A conversion worker exited abruptly; restarting the pool.")
+                executor.shutdown()
+                executor = start_pool()
+                future = executor.submit(conversion.convert_pdf_to_images, input_file, conversion.processing_folder)
+            future.add_done_callback(lambda f, path=input_file, date=date_folder: complete_queue.put((path, date, f)))
+            totals['files'] += 1
+    finally:
+        executor.shutdown()
+
+    complete_queue.put(end_of_queue)
+    download_thread.join()
+    complete_thread.join()
+
+    metrics.write_textfile()
+    elapsed = time.monotonic() - start_time
+    if totals['files'] and elapsed > 0:
+        logging.info(f"Pipeline converted {totals['files']} files ({totals['pages']} pages, {totals['completed']} completed) "
+                     f"in {elapsed:.1f}s: {totals['files'] / elapsed:.2f} files/sec, {totals['pages'] / elapsed:.2f} pages/sec.")
+    return totals
+
+
+def run_daily_tasks():
+    # Retention, report and status email, run once per day after the pipeline
+    import delete
+    import report
+    import demail
+    delete.move_processed_folders_to_deleted()
+    report.export_source_file_data_to_excel()
+    demail.send_daily_status_email()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run download, conversion and completion as one pipeline.")
+    parser.add_argument("--workers", type=int, default=conversion.default_workers, help="Number of conversion processes.")
+    parser.add_argument("--download-workers", type=int, default=downloader.default_download_workers, help="Number of concurrent SFTP channels.")
+    parser.add_argument("--queue-size", type=int, default=32, help="Files allowed between stages at once.")
+    parser.add_argument("--no-download", action="store_true", help="Only convert files already in today's input folder.")
+    parser.add_argument("--interval", type=int, default=0, help="Seconds between passes; 0 runs a single pass and exits.")
+    parser.add_argument("--daily-tasks", action="store_true", help="Also run retention, the report and the status email once a day.")
+    parser.add_argument("--daily-hour", type=int, default=20, help="Hour of the day after which the daily tasks run.")
+    parser.add_argument("--watch", action="store_true", help="Convert files as they land in the input folder until stopped, instead of in passes.")
+    parser.add_argument("--poll", action="store_true", help="With --watch, poll the input folder instead of using inotify.")
+    parser.add_argument("--catch-up", action="store_true", help="Before each pass, work through outstanding files from earlier days.")
+    args = parser.parse_args()
+    logging_setup.setup_logging()
+
+    last_daily_run = {'date': None}
+
+    def check_daily_tasks():
+        now = datetime.now()
+        if args.daily_tasks and now.hour >= args.daily_hour and last_daily_run['date'] != now.date():
+            try:
+                run_daily_tasks()
+            except Exception as e:
+                logging.error(f"Error running daily tasks: {str(e)}")
+            last_daily_run['date'] = now.date()
+
+    if args.watch:
+        if args.catch_up:
+            catchup.run_catchup(max(1, args.workers))
+        # Runs until SIGTERM or Ctrl-C; files already converting are finished first
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+        run_pipeline(max(1, args.workers), args.download_workers, max(1, args.queue_size), watch=stop_event,
+                     on_idle=check_daily_tasks, use_inotify=not args.poll)
+        database.close_connection()
+        return
+
+    while True:
+        if args.catch_up:
+            catchup.run_catchup(max(1, args.workers))
+        run_pipeline(max(1, args.workers), args.download_workers, max(1, args.queue_size), download=not args.no_download)
+        check_daily_tasks()
+        database.close_connection()
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import time
+import shutil
+import fcntl
+import filecmp
+import logging
+import database
+import metrics
+
+# How a file is put somewhere it must exist in full: 'auto' tries a reflink, then a hardlink and only
+# copies when neither works (across filesystems); 'hardlink' skips the reflink attempt; 'copy' always
+# copies. Originals and pages are never modified after they are written, so sharing their blocks is safe.
+placement_mode = 'auto'
+
+# ioctl that makes the destination share the source's extents on copy-on-write filesystems (btrfs, XFS)
+FICLONE = 0x40049409
+
+# Ways a file can be placed, and whether each one writes the file's bytes again
+methods = {'rename': False, 'reflink': False, 'hardlink': False, 'copy': True}
+
+
+def reflink(source_path, destination_path):
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except OSError:
+            os.remove(destination_path)
+            raise
+
+
+def place_file(source_path, destination_path, mode=None, source_file=None, move=False):
+    # Put a copy of source_path at destination_path without writing its bytes where possible, and
+    # return the method used. With move the source is no longer needed, so a rename comes first.
+    # Each placement is recorded as a place_<method> metric carrying the file's size.
+    mode = mode or placement_mode
+    size = os.path.getsize(source_path)
+    start_time = time.perf_counter()
+    method = 'copy'
+    if move:
+        try:
+            os.rename(source_path, destination_path)
+            method = 'rename'
+        except OSError:
+            pass
+    if method == 'copy' and mode == 'auto':
+        try:
+            reflink(source_path, destination_path)
+            method = 'reflink'
+        except OSError:
+            pass
+    if method == 'copy' and mode in ('auto', 'hardlink'):
+        try:
+            os.link(source_path, destination_path)
+            method = 'hardlink'
+        except OSError:
+            pass
+    if method == 'copy':
+        shutil.copy2(source_path, destination_path)
+    if move and method != 'rename':
+        os.remove(source_path)
+    metrics.record(f"place_{method}", (time.perf_counter() - start_time) * 1000, source_file, bytes_count=size)
+    return method
+
+
+def place_original(input_file, file_folder, move=False):
+    # Make sure file_folder/original holds the PDF; with move the input file is consumed
+    file_name = os.path.basename(input_file)
+    destination_path = os.path.join(file_folder, "original", file_name)
+    if os.path.exists(destination_path):
+        # Already the same file, or a copy with the same bytes (filecmp stops at the first difference)
+        if os.path.samefile(input_file, destination_path) or filecmp.cmp(input_file, destination_path, shallow=False):
+            if move:
+                os.remove(input_file)
+            return None
+        os.remove(destination_path)
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    return place_file(input_file, destination_path, source_file=file_name, move=move)
+
+
+def copy_file(source_path, destination_path):
+    # copy_function for shutil.copytree: a reflink can still share blocks between separate mounts of
+    # one btrfs filesystem, which report different devices
+    try:
+        reflink(source_path, destination_path)
+        shutil.copystat(source_path, destination_path)
+        metrics.record('place_reflink', 0.0, bytes_count=os.path.getsize(source_path))
+    except OSError:
+        shutil.copy2(source_path, destination_path)
+        metrics.record('place_copy', 0.0, bytes_count=os.path.getsize(source_path))
+    return destination_path
+
+
+def get_placement_totals(conn, since):
+    # Bytes placed by each method since a 'YYYY-MM-DD HH:MM:SS' timestamp
+    rows = conn.execute('''SELECT stage, COALESCE(SUM(bytes), 0) FROM Metrics
+                           WHERE recorded_datetime >= ? AND stage LIKE 'place\\_%' ESCAPE '\\'
+                           GROUP BY stage''', (since,)).fetchall()
+    return {stage[len('place_'):]: total_bytes for stage, total_bytes in rows}
+
+
+def log_placement_totals(since):
+    # One line per run with the bytes that were linked, reflinked or renamed instead of written again
+    metrics.flush()
+    try:
+        totals = get_placement_totals(database.get_connection(), since)
+        if totals:
+            avoided = sum(total_bytes for method, total_bytes in totals.items() if not methods.get(method, True))
+            placed = ", ".join(f"{total_bytes} bytes by {method}" for method, total_bytes in sorted(totals.items()))
+            logging.info(f"Placed files without writing {avoided} bytes ({placed}).")
+        return totals
+    except Exception as e:
+        logging.error(f"Error reading placement totals: {str(e)}")
+        return {}
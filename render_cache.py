@@ -0,0 +1,129 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from datetime import datetime
+import placement
+
+# Content-addressed store of rendered pages: cache/<key>/<page number>.<ext>, where the key is the
+# SHA-256 of the PDF's bytes plus the render parameters. RenderCache rows track size and last use.
+cache_folder = "cache/"
+
+# Total bytes kept in the cache before least recently used entries are evicted (0 disables the cache)
+cache_max_bytes = 20 * 1024 ** 3
+
+hash_block_size = 1024 * 1024
+
+
+def enabled():
+    return cache_max_bytes > 0
+
+
+def hash_file(input_file):
+    # SHA-256 of a file's bytes, the digest input.py records as SourceFile.content_hash
+    digest = hashlib.sha256()
+    with open(input_file, 'rb') as f:
+        for block in iter(lambda: f.read(hash_block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_cache_key(input_file, render_params):
+    digest = hashlib.sha256()
+    with open(input_file, 'rb') as f:
+        for block in iter(lambda: f.read(hash_block_size), b''):
+            digest.update(block)
+    digest.update(json.dumps(render_params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def link_or_copy(source_path, destination_path):
+    # Share the page's blocks (reflink or hardlink) where the filesystem allows, otherwise copy it
+    placement.place_file(source_path, destination_path)
+
+
+def lookup(conn, cache_key):
+    row = conn.execute('''SELECT page_count FROM RenderCache WHERE cache_key=?''', (cache_key,)).fetchone()
+    if row and os.path.isdir(os.path.join(cache_folder, cache_key)):
+        return row[0]
+    return None
+
+
+def restore(conn, cache_key, converted_folder, file_name_no_extension):
+    # Link a cached rendering into converted/; returns the page file names, or None on a miss
+    if lookup(conn, cache_key) is None:
+        return None
+    entry_folder = os.path.join(cache_folder, cache_key)
+    restored = []
+    for cached_page in sorted(os.listdir(entry_folder), key=lambda f: int(os.path.splitext(f)[0])):
+        page_number, extension = os.path.splitext(cached_page)
+        page_file = f"{file_name_no_extension}_{page_number}{extension}"
+        destination_path = os.path.join(converted_folder, page_file)
+        if not os.path.exists(destination_path):
+            link_or_copy(os.path.join(entry_folder, cached_page), destination_path)
+        restored.append(page_file)
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute('''UPDATE RenderCache SET hits=hits + 1, last_used_datetime=? WHERE cache_key=?''', (now, cache_key))
+    conn.commit()
+    return restored
+
+
+def store(conn, cache_key, source_file, converted_folder, file_name_no_extension):
+    # Add a freshly rendered file to the cache, then evict down to the size cap
+    entry_folder = os.path.join(cache_folder, cache_key)
+    if os.path.isdir(entry_folder):
+        return
+
+    # Build the entry under a temporary name so other workers never see a half-written one
+    temp_folder = f"{entry_folder}.tmp-{os.getpid()}"
+    os.makedirs(temp_folder, exist_ok=True)  # Also creates the cache folder itself
+    prefix = f"{file_name_no_extension}_"
+    size_bytes = 0
+    page_count = 0
+    for page_file in os.listdir(converted_folder):
+        if not page_file.startswith(prefix):
+            continue
+        page_number, extension = os.path.splitext(page_file[len(prefix):])
+        if not page_number.isdigit():
+            continue
+        cached_page = os.path.join(temp_folder, f"{page_number}{extension}")
+        link_or_copy(os.path.join(converted_folder, page_file), cached_page)
+        size_bytes += os.path.getsize(cached_page)
+        page_count += 1
+    try:
+        os.rename(temp_folder, entry_folder)
+    except OSError:
+        # Another worker stored the same entry first
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        return
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute('''INSERT OR REPLACE INTO RenderCache
+                    (cache_key, source_file, page_count, size_bytes, hits, created_datetime, last_used_datetime)
+                    VALUES (?, ?, ?, ?, 0, ?, ?)''',
+                 (cache_key, source_file, page_count, size_bytes, now, now))
+    conn.commit()
+    evict(conn)
+
+
+def evict(conn):
+    # Drop least recently used entries until the cache fits in cache_max_bytes
+    total_bytes = conn.execute('''SELECT COALESCE(SUM(size_bytes), 0) FROM RenderCache''').fetchone()[0]
+    if total_bytes <= cache_max_bytes:
+        return
+    rows = conn.execute('''SELECT cache_key, size_bytes FROM RenderCache ORDER BY last_used_datetime''').fetchall()
+    for cache_key, size_bytes in rows:
+        if total_bytes <= cache_max_bytes:
+            break
+        conn.execute('''DELETE FROM RenderCache WHERE cache_key=?''', (cache_key,))
+        conn.commit()
+        shutil.rmtree(os.path.join(cache_folder, cache_key), ignore_errors=True)
+        total_bytes -= size_bytes
+        logging.info(f"Evicted render cache entry {cache_key} ({size_bytes} bytes).")
+
+
+def record_cache_result(conn, source_file, hit):
+    conn.execute('''UPDATE SourceFile SET cache_status=? WHERE source_file=?''', ('hit' if hit else 'miss', source_file))
+    conn.commit()
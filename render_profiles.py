@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import logging
+
+# Optional JSON file overriding the profiles and rules below:
+# {"profiles": {"name": {...settings...}}, "rules": [{"profile": "name", "min_pages": 10, ...}], "default": "name"}
+profiles_file = "render_profiles.json"
+
+# Settings a profile may set; anything it leaves out comes from base_settings
+base_settings = {
+    'dpi': 300,
+    'format': 'jpeg',          # jpeg, png or tiff
+    'quality': 75,             # JPEG quality (PIL's default)
+    'optimize': False,         # JPEG Huffman table optimisation
+    'progressive': False,      # progressive JPEG
+    'grayscale': False,        # render 8-bit grayscale
+    'bilevel': False,          # save as 1-bit; PNG/TIFF only (TIFF uses Group 4 compression)
+    'thread_count': 1,         # pdf2image threads per conversion call
+    'use_pdftocairo': False,
+    'encode_threads': 1,       # threads encoding a chunk's pages; PIL releases the GIL while encoding
+    'thumbnail_width': 0,      # also write a JPEG thumbnail this many pixels wide to thumbnails/ (0 = none)
+    'thumbnail_quality': 70,
+    'extra_formats': [],       # also write these formats (webp, avif) to a folder named after each format
+    'extra_quality': 80,
+}
+
+profiles = {
+    'default': {},
+    'text': {'dpi': 200, 'format': 'png', 'grayscale': True},
+    'bilevel': {'dpi': 200, 'format': 'tiff', 'grayscale': True, 'bilevel': True},
+    'preview': {'dpi': 150, 'quality': 70, 'optimize': True, 'progressive': True},
+    'web': {'quality': 85, 'optimize': True, 'encode_threads': 2, 'thumbnail_width': 320, 'extra_formats': ['webp']},
+}
+
+# Rules are checked in order and the first match picks the profile. Each rule may set
+# min_pages, max_pages, min_size_mb and max_size_mb. No rules by default: every file gets default_profile.
+rules = []
+
+default_profile = 'default'
+
+file_extensions = {'jpeg': '.jpg', 'png': '.png', 'tiff': '.tif'}
+
+# Formats that can be written alongside the main image; AVIF needs a Pillow build with AVIF support
+extra_extensions = {'webp': '.webp', 'avif': '.avif'}
+
+thumbnail_folder = "thumbnails"
+
+
+def load_profiles(path=None):
+    # Merge profiles, rules and the default profile from a JSON config file, if one exists
+    global rules, default_profile
+    path = path or profiles_file
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        config = json.load(f)
+    profiles.update(config.get('profiles', {}))
+    rules = config.get('rules', rules)
+    default_profile = config.get('default', default_profile)
+    for name in [default_profile] + [rule['profile'] for rule in rules]:
+        if name not in profiles:
+            raise ValueError(f"Unknown render profile '{name}' in {path}")
+    logging.info(f"Loaded render profiles from {path}.")
+
+
+def get_profile(name):
+    if name not in profiles:
+        raise ValueError(f"Unknown render profile '{name}'")
+    settings = dict(base_settings)
+    settings.update(profiles[name])
+    if settings['format'] not in file_extensions:
+        raise ValueError(f"Unsupported format '{settings['format']}' in render profile '{name}'")
+    if settings['bilevel'] and settings['format'] == 'jpeg':
+        raise ValueError(f"Render profile '{name}' is bilevel, which needs png or tiff output")
+    for extra_format in settings['extra_formats']:
+        if extra_format not in extra_extensions:
+            raise ValueError(f"Unsupported extra format '{extra_format}' in render profile '{name}'")
+    return settings
+
+
+def rule_matches(rule, page_count, size_mb):
+    if page_count is not None:
+        if page_count < rule.get('min_pages', 0) or page_count > rule.get('max_pages', float('inf')):
+            return False
+    elif 'min_pages' in rule or 'max_pages' in rule:
+        return False
+    return rule.get('min_size_mb', 0) <= size_mb <= rule.get('max_size_mb', float('inf'))
+
+
+def select_profile(input_file, page_count):
+    # Pick a profile name for a file from its page count and size
+    size_mb = os.path.getsize(input_file) / 1048576
+    for rule in rules:
+        if rule_matches(rule, page_count, size_mb):
+            return rule['profile']
+    return default_profile
+
+
+def get_convert_options(settings):
+    # Keyword arguments for pdf2image's convert_from_path. Poppler hands pages over as raw PPM/PGM
+    # so each page is encoded once, by save_image, rather than decoded from a JPEG and re-encoded.
+    # pdftocairo has no PPM output, so it hands pages over as lossless PNG instead.
+    return {
+        'dpi': settings['dpi'],
+        'fmt': 'png' if settings['use_pdftocairo'] else 'ppm',
+        'grayscale': settings['grayscale'],
+        'thread_count': settings['thread_count'],
+        'use_pdftocairo': settings['use_pdftocairo'],
+    }
+
+
+def save_image(image, image_path, settings):
+    # Encode one rendered page according to the profile
+    if settings['bilevel']:
+        image = image.convert('1')
+    if settings['format'] == 'jpeg':
+        image.save(image_path, 'JPEG', quality=settings['quality'], optimize=settings['optimize'],
+                   progressive=settings['progressive'])
+    elif settings['format'] == 'tiff':
+        image.save(image_path, 'TIFF', compression='group4' if settings['bilevel'] else 'tiff_lzw')
+    else:
+        image.save(image_path, 'PNG', optimize=settings['optimize'])
+
+
+def has_extra_outputs(settings):
+    return bool(settings['thumbnail_width'] or settings['extra_formats'])
+
+
+def prepare_output_folders(file_folder, settings):
+    # Folders for the thumbnail and extra-format outputs, next to converted/
+    if settings['thumbnail_width']:
+        os.makedirs(os.path.join(file_folder, thumbnail_folder), exist_ok=True)
+    for extra_format in settings['extra_formats']:
+        os.makedirs(os.path.join(file_folder, extra_format), exist_ok=True)
+
+
+def save_extra_outputs(image, file_folder, page_name, settings):
+    # Write the thumbnail and extra formats of one page; returns (thumbnail_bytes, extra_bytes)
+    thumbnail_size = None
+    extra_size = None
+    if settings['thumbnail_width'] and image.width > 0:
+        width = min(settings['thumbnail_width'], image.width)
+        height = max(1, round(image.height * width / image.width))
+        # reducing_gap shrinks by whole factors first, which is much cheaper than a full resample
+        thumbnail = image.resize((width, height), reducing_gap=3.0)
+        thumbnail_path = os.path.join(file_folder, thumbnail_folder, page_name + file_extensions['jpeg'])
+        thumbnail.save(thumbnail_path, 'JPEG', quality=settings['thumbnail_quality'], optimize=True)
+        thumbnail.close()
+        thumbnail_size = os.path.getsize(thumbnail_path)
+    for extra_format in settings['extra_formats']:
+        extra_path = os.path.join(file_folder, extra_format, page_name + extra_extensions[extra_format])
+        image.save(extra_path, extra_format.upper(), quality=settings['extra_quality'])
+        extra_size = (extra_size or 0) + os.path.getsize(extra_path)
+    return thumbnail_size, extra_size
+
+
+def save_outputs(image, file_folder, page_name, settings):
+    # Encode every output of one page from the same decoded bitmap. Returns the main image's file
+    # name, its size, the thumbnail and extra-format sizes, and the total encode time in ms.
+    start_time = time.perf_counter()
+    image_file = page_name + file_extensions[settings['format']]
+    image_path = os.path.join(file_folder, "converted", image_file)
+    save_image(image, image_path, settings)
+    thumbnail_size, extra_size = save_extra_outputs(image, file_folder, page_name, settings)
+    encode_ms = (time.perf_counter() - start_time) * 1000
+    return image_file, os.path.getsize(image_path), thumbnail_size, extra_size, encode_ms
+
+
+def save_extra_outputs_from_file(image_path, file_folder, page_name, settings):
+    # Rebuild the thumbnail and extra formats of a page restored from the render cache
+    from PIL import Image
+    with Image.open(image_path) as image:
+        if image.mode == '1':
+            image = image.convert('L')
+        return save_extra_outputs(image, file_folder, page_name, settings)
@@ -1,46 +1,193 @@
 import os
-import sqlite3
-import pandas as pd
+import csv
+import database
+import logging_setup
+import metrics
+import argparse
 from datetime import datetime
 import logging
 
-def export_source_file_data_to_excel():
+# Constants
+db_file = "conversion.db"
+reports_folder = "reports/"
+
+# Rows fetched from SQLite per round trip while streaming a report
+fetch_chunk_size = 5000
+
+source_file_query = '''SELECT * FROM SourceFile WHERE updated_datetime >= ? AND updated_datetime < ?
+                       ORDER BY updated_datetime'''
+
+# Rows stamped in the current second are left for the next run, since more may still arrive in it
+incremental_query = '''SELECT * FROM SourceFile WHERE updated_datetime > ? AND updated_datetime < ?
+                       ORDER BY updated_datetime'''
+
+
+def get_status_counts(conn, date):
+    # Count of SourceFile rows per status for one day, from a single grouped query on the date index
+    rows = conn.execute('''SELECT status, COUNT(*) FROM SourceFile
+                           WHERE updated_datetime >= ? AND updated_datetime < ?
+                           GROUP BY status''', database.day_range(date)).fetchall()
+    return dict(rows)
+
+
+def iter_rows(cursor):
+    # Yield query results a chunk at a time so memory stays flat however many rows match
+    while True:
+        rows = cursor.fetchmany(fetch_chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def get_watermark(conn, report_name):
+    row = conn.execute('''SELECT last_updated_datetime FROM ReportWatermark WHERE report_name=?''', (report_name,)).fetchone()
+    return row[0] if row else ''
+
+
+def set_watermark(conn, report_name, last_updated_datetime):
+    conn.execute('''INSERT OR REPLACE INTO ReportWatermark (report_name, last_updated_datetime, report_datetime)
+                    VALUES (?, ?, ?)''', (report_name, last_updated_datetime, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    conn.commit()
+
+
+def write_xlsx(path, header, rows, latencies):
+    # openpyxl's write-only mode streams rows to disk instead of building the sheet in memory
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('SourceFile')
+    sheet.append(header)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    latency_sheet = workbook.create_sheet('Stage latency')
+    latency_sheet.append(['stage', 'samples', 'p50_ms', 'p95_ms'])
+    for stage, (samples, p50, p95) in sorted(latencies.items()):
+        latency_sheet.append([stage, samples, p50, p95])
+    workbook.save(path)
+    return count
+
+
+def write_csv(path, header, rows):
+    count = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_parquet(path, header, rows):
+    # Every fetch_chunk_size rows become one Parquet row group
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    count = 0
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(dict(zip(header, row)))
+            if len(chunk) >= fetch_chunk_size:
+                writer = write_parquet_chunk(pa, pq, writer, path, chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk or writer is None:
+            writer = write_parquet_chunk(pa, pq, writer, path, chunk)
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def write_parquet_chunk(pa, pq, writer, path, chunk):
+    table = pa.Table.from_pylist(chunk)
+    if writer is None:
+        writer = pq.ParquetWriter(path, table.schema)
+    writer.write_table(table.cast(writer.schema))
+    return writer
+
+
+def export_source_file_data(output_format='xlsx', incremental=False, report_name='daily'):
+    # Export today's SourceFile rows, or with incremental=True only the rows changed since the
+    # last incremental export, streaming them into an xlsx, csv or parquet file
     try:
-        # Constants
-        db_file = "conversion.db"
-        reports_folder = "reports/"
-        
-        # Get current date
         today_date = datetime.now().strftime("%Y-%m-%d")
-        
+
         # Create reports folder if it doesn't exist
         os.makedirs(reports_folder, exist_ok=True)
 
         # Connect to SQLite database
-        conn = sqlite3.connect(db_file)
+        conn = database.connect(db_file)
+        database.ensure_schema(conn)
+        cursor = conn.cursor()
+
+        if incremental:
+            watermark = get_watermark(conn, report_name)
+            cursor.execute(incremental_query, (watermark, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            file_name = f"Report_{today_date}_{report_name}_{datetime.now().strftime('%H%M%S')}.{output_format}"
+        else:
+            cursor.execute(source_file_query, database.day_range(today_date))
+            file_name = f"Report_{today_date}.{output_format}"
+        header = [column[0] for column in cursor.description]
+        updated_index = header.index('updated_datetime')
+
+        # Track the newest updated_datetime written so the next incremental export starts after it
+        newest = {'updated_datetime': None}
+
+        def tracked_rows():
+            for row in iter_rows(cursor):
+                newest['updated_datetime'] = row[updated_index]
+                yield row
+
+        report_path = os.path.join(reports_folder, file_name)
+        if incremental:
+            # Never overwrite an earlier incremental report written in the same second
+            base_path, extension = os.path.splitext(report_path)
+            suffix = 1
+            while os.path.exists(report_path):
+                report_path = f"{base_path}_{suffix}{extension}"
+                suffix += 1
+        if output_format == 'xlsx':
+            latencies = metrics.get_stage_latencies(conn, today_date)
+            count = write_xlsx(report_path, header, tracked_rows(), latencies)
+        elif output_format == 'csv':
+            count = write_csv(report_path, header, tracked_rows())
+        elif output_format == 'parquet':
+            count = write_parquet(report_path, header, tracked_rows())
+        else:
+            raise ValueError(f"Unsupported report format '{output_format}'")
 
-        # Query to select data from SourceFile table for today's date
-        query = f"SELECT * FROM SourceFile WHERE substr(updated_datetime, 1, 10) = '{today_date}'"
-        
-        # Read data into a DataFrame
-        df = pd.read_sql_query(query, conn)
+        if incremental and newest['updated_datetime']:
+            set_watermark(conn, report_name, newest['updated_datetime'])
 
         # Close the database connection
         conn.close()
 
-        # Write DataFrame to Excel file
-        excel_file_path = os.path.join(reports_folder, f"Report_{today_date}.xlsx")
-        df.to_excel(excel_file_path, index=False)
-
-        logging.info(f"Data exported to Excel file: {excel_file_path}")
+        logging.info(f"Exported {count} rows to report file: {report_path}")
+        return report_path
     except Exception as e:
-        logging.error(f"Error exporting data to Excel file: {str(e)}")
+        logging.error(f"Error exporting data to report file: {str(e)}")
+        return None
+
+
+def export_source_file_data_to_excel():
+    return export_source_file_data('xlsx')
 
-if __name__ == "__main__":
-    # Configure logging
-    log_file = 'logs/pdf_convert.log'
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    # Call the function to export source file data to Excel
-    export_source_file_data_to_excel()
+def main():
+    parser = argparse.ArgumentParser(description="Export SourceFile rows to a report file.")
+    parser.add_argument("--format", choices=['xlsx', 'csv', 'parquet'], default='xlsx')
+    parser.add_argument("--incremental", action="store_true", help="Only export rows changed since the last incremental report.")
+    parser.add_argument("--report-name", default='daily', help="Watermark name for incremental reports.")
+    args = parser.parse_args()
+    logging_setup.setup_logging()
+
+    # Call the function to export source file data
+    export_source_file_data(args.format, args.incremental, args.report_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+# Watches input/ and its <yymmdd> date folders for PDFs that have finished arriving. With inotify
+# a file is ready when its writer closes it or it is renamed into place (as input.py does with its
+# .part files); without inotify the folders are polled and a file is ready once its size and mtime
+# have held still for settle_seconds.
+input_folder = "input/"
+
+# Seconds between polls without inotify, and between safety-net rescans with it
+poll_interval = 5
+rescan_interval = 300
+
+# How long the size and mtime of a file found by a scan must stay unchanged before it counts as written
+settle_seconds = 2
+
+# Files still being written use these names and are never queued
+temp_suffixes = ('.part', '.tmp')
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+event_header = struct.Struct('iIII')
+
+
+def is_candidate(name):
+    return name.endswith('.pdf') and not name.startswith('.') and not name.endswith(temp_suffixes)
+
+
+def open_inotify():
+    # An inotify file descriptor, or None where inotify is unavailable (non-Linux, or out of instances)
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None, None
+    if fd < 0:
+        return None, None
+    return libc, fd
+
+
+def add_watch(libc, fd, path, watches):
+    wd = libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+    if wd < 0:
+        logging.error(f"Error watching {path}: {os.strerror(ctypes.get_errno())}")
+        return
+    watches[wd] = path
+
+
+def read_events(fd):
+    # Decode every queued inotify event as (wd, mask, name)
+    events = []
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        return events
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, length = event_header.unpack_from(data, offset)
+        offset += event_header.size
+        name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+        offset += length
+        events.append((wd, mask, name))
+    return events
+
+
+def list_folders(folder):
+    # input/ itself plus each of its date folders
+    folders = [folder]
+    if os.path.isdir(folder):
+        folders += sorted(entry.path for entry in os.scandir(folder) if entry.is_dir())
+    return folders
+
+
+def scan(folder):
+    # Every candidate PDF under input/ with its current (size, mtime)
+    files = {}
+    for path in list_folders(folder):
+        try:
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_file() and is_candidate(entry.name):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[entry.path] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def watch_input_folder(on_ready, stop_event, on_idle=None, folder=None, use_inotify=True):
+    # Call on_ready(path) once for each PDF as soon as it is fully written, until stop_event is set.
+    # Files already waiting when the watch starts are reported first, whatever date folder they are in.
+    # on_idle, if given, is called between waits so the caller can run periodic work.
+    folder = folder or input_folder
+    os.makedirs(folder, exist_ok=True)
+    libc, fd = open_inotify() if use_inotify else (None, None)
+    watches = {}
+    if fd is not None:
+        for path in list_folders(folder):
+            add_watch(libc, fd, path, watches)
+        logging.info(f"Watching {folder} with inotify.")
+    else:
+        logging.info(f"Watching {folder} by polling every {poll_interval}s.")
+
+    reported = {}   # path -> (size, mtime) when it was reported, so a file is only reported once
+    settling = {}   # path -> ((size, mtime), time first seen) for files found by a scan, until they hold still
+
+    def report(path, signature):
+        if reported.get(path) != signature:
+            reported[path] = signature
+            on_ready(path)
+
+    def rescan():
+        now = time.monotonic()
+        files = scan(folder)
+        for path in list(reported):
+            if path not in files:
+                del reported[path]
+        for path, signature in files.items():
+            if reported.get(path) == signature:
+                continue
+            previous = settling.get(path)
+            if previous is None or previous[0] != signature:
+                settling[path] = (signature, now)
+            elif now - previous[1] >= settle_seconds:
+                del settling[path]
+                report(path, signature)
+        for path in list(settling):
+            if path not in files:
+                del settling[path]
+
+    try:
+        # Files left from before the watch started are complete unless their writer is still running,
+        # so they go through the same settle check as polled files
+        rescan()
+        last_rescan = time.monotonic()
+        while not stop_event.is_set():
+            if fd is None:
+                stop_event.wait(min(poll_interval, settle_seconds) if settling else poll_interval)
+                rescan()
+            else:
+                readable, _, _ = select.select([fd], [], [], settle_seconds if settling else poll_interval)
+                if readable:
+                    for wd, mask, name in read_events(fd):
+                        if mask & IN_Q_OVERFLOW:
+                            # Events were dropped; a full rescan finds whatever they were about
+                            last_rescan = 0
+                            continue
+                        path = os.path.join(watches.get(wd, folder), name)
+                        if mask & IN_ISDIR:
+                            if mask & (IN_CREATE | IN_MOVED_TO) and watches.get(wd) == folder:
+                                # A new date folder: watch it, then pick up anything written before the watch
+                                add_watch(libc, fd, path, watches)
+                                last_rescan = 0
+                        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_candidate(name):
+                            try:
+                                stat = os.stat(path)
+                            except FileNotFoundError:
+                                continue
+                            report(path, (stat.st_size, stat.st_mtime))
+                if settling or time.monotonic() - last_rescan >= rescan_interval:
+                    rescan()
+                    last_rescan = time.monotonic()
+            if on_idle is not None:
+                on_idle()
+    finally:
+        if fd is not None:
+            os.close(fd)